@@ -1,49 +1,101 @@
-from typing import Optional
+from typing import Iterator, Optional
+from sqlalchemy import bindparam, delete, select, update
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.orm import Session
+from ttl_cache import TTLCache
 from . import models
 
+USER_COLUMNS = (
+    models.DatabaseUser.username,
+    models.DatabaseUser.email,
+    models.DatabaseUser.password_hash,
+    models.DatabaseUser.scope,
+    models.DatabaseUser.max_owned_servers,
+)
+TOKEN_COLUMNS = (models.DatabaseSignupToken.token, models.DatabaseSignupToken.email, models.DatabaseSignupToken.scope)
+PERMISSIONS_COLUMNS = (models.DatabasePermissions.server_id, models.DatabasePermissions.user_id, models.DatabasePermissions.scope)
+
+USER_CACHE: TTLCache[str, models.User] = TTLCache(ttl=60, maxsize=1024)
+USER_BY_EMAIL_CACHE: TTLCache[str, models.User] = TTLCache(ttl=60, maxsize=1024)
+SERVER_NICKNAME_CACHE: TTLCache[str, str] = TTLCache(ttl=60, maxsize=1024)
+ALL_SERVER_NICKNAMES_CACHE: TTLCache[None, dict[str, str]] = TTLCache(ttl=60)
+
+GET_USER_BY_USERNAME = select(*USER_COLUMNS).where(models.DatabaseUser.username == bindparam('username'))
+GET_USERS = select(*USER_COLUMNS).offset(bindparam('skip')).limit(bindparam('limit')).execution_options(yield_per=200)
+GET_USER_BY_EMAIL = select(*USER_COLUMNS).where(models.DatabaseUser.email == bindparam('email'))
+GET_TOKEN = select(*TOKEN_COLUMNS).where(models.DatabaseSignupToken.token == bindparam('token'))
+GET_SERVER_NICKNAME = select(models.DatabaseServerNickname.nickname).where(models.DatabaseServerNickname.server_id == bindparam('server_id'))
+GET_ALL_SERVER_NICKNAMES = select(models.DatabaseServerNickname.server_id, models.DatabaseServerNickname.nickname).execution_options(yield_per=1000)
+GET_SERVER_PERMISSIONS = select(*PERMISSIONS_COLUMNS).where(
+    models.DatabasePermissions.server_id == bindparam('server_id'),
+    models.DatabasePermissions.user_id == bindparam('user_id'),
+)
+
+
+def _invalidate_users():
+    USER_CACHE.clear()
+    USER_BY_EMAIL_CACHE.clear()
+
 
 def get_user(db: Session, user_id: str) -> Optional[models.User]:
-    user = db.query(models.DatabaseUser).filter(models.DatabaseUser.username == user_id).first()
-    return models.User.from_database_user(user) if user is not None else user
+    cached_user = USER_CACHE.get(user_id)
+    if cached_user is not None:
+        return cached_user
+
+    user = db.execute(GET_USER_BY_USERNAME, {'username': user_id}).first()
+    return USER_CACHE.set(user_id, models.User.from_database_user(user)) if user is not None else user
 
 def get_token(db: Session, token: str) -> Optional[models.SignupToken]:
-    token = db.query(models.DatabaseSignupToken).filter(models.DatabaseSignupToken.token == token).first()
-    return models.SignupToken.from_database_token(token)
+    database_token = db.execute(GET_TOKEN, {'token': token}).first()
+    return models.SignupToken.from_database_token(database_token) if database_token is not None else None
 
 
 def get_user_by_email(db: Session, email: str) -> Optional[models.User]:
-    user = db.query(models.DatabaseUser).filter(models.DatabaseUser.email == email).first()
-    return models.User.from_database_user(user) if user is not None else user
+    cached_user = USER_BY_EMAIL_CACHE.get(email)
+    if cached_user is not None:
+        return cached_user
 
+    user = db.execute(GET_USER_BY_EMAIL, {'email': email}).first()
+    return USER_BY_EMAIL_CACHE.set(email, models.User.from_database_user(user)) if user is not None else user
 
-def get_users(db: Session, skip: int = 0, limit: int = 100) -> list[models.User]:
-    return [models.User.from_database_user(user) for user in db.query(models.DatabaseUser).offset(skip).limit(limit).all()]
 
+def iter_users(db: Session, skip: int = 0, limit: int = 100) -> Iterator[models.User]:
+    return (models.User.from_database_user(user) for user in db.execute(GET_USERS, {'skip': skip, 'limit': limit}))
 
-def create_user(db: Session, user: models.User):
-    db_user = models.DatabaseUser(email=user.email, password_hash=user.password_hash, username=user.username, scope=':'.join(user.permissions))
 
-    user = db.query(models.DatabaseUser).filter(models.DatabaseUser.username == db_user.username).delete()
-    
-    db.add(db_user)
+def create_user(db: Session, user: models.User):
+    statement = insert(models.DatabaseUser).values(
+        email=user.email, password_hash=user.password_hash, username=user.username, scope=list(user.permissions), max_owned_servers=user.max_owned_servers,
+    )
+    db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[models.DatabaseUser.username],
+            set_={
+                'email': statement.excluded.email,
+                'password_hash': statement.excluded.password_hash,
+                'scope': statement.excluded.scope,
+                'max_owned_servers': statement.excluded.max_owned_servers,
+            },
+        )
+    )
     db.commit()
-    db.refresh(db_user)
-    return models.User.from_database_user(db_user)
+    _invalidate_users()
+    return user
 
 
 def delete_user(db: Session, username: str):
-    db.query(models.DatabaseUser).filter(models.DatabaseUser.username == username).delete()
+    db.execute(delete(models.DatabaseUser).where(models.DatabaseUser.username == username))
     db.commit()
+    _invalidate_users()
 
 
-def change_permissions(db: Session, username: str, permissions: list[models.Permission]):
-    db_user = db.query(models.DatabaseUser).filter(models.DatabaseUser.username == username)
-
-    db_user.update({'scope': ':'.join(permissions)})
-    # db.query(models.DatabaseUser).filter(models.DatabaseUser.username == username).delete()
+def change_permissions(db: Session, username: str, permissions: list[models.Permission]) -> Optional[models.UserBase]:
+    user = db.execute(
+        update(models.DatabaseUser).where(models.DatabaseUser.username == username).values(scope=list(permissions)).returning(*USER_COLUMNS)
+    ).first()
     db.commit()
-    return models.UserBase.from_database_user(db_user.first())
+    _invalidate_users()
+    return models.UserBase.from_database_user(user) if user is not None else user
 
 
 def create_user_from_token(db: Session, token: str, username: str, password_hash: str):
@@ -51,54 +103,83 @@ def create_user_from_token(db: Session, token: str, username: str, password_hash
     if token_item is None:
         raise Exception()
     
-    db_user = models.DatabaseUser(email=token_item.email, scope=':'.join(token_item.permissions), username=username, password_hash=password_hash)
-    
-    db.query(models.DatabaseUser).filter(models.DatabaseUser.email == db_user.email).delete()
-
-    db.add(db_user)
+    statement = insert(models.DatabaseUser).values(email=token_item.email, scope=list(token_item.permissions), username=username, password_hash=password_hash)
+    db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[models.DatabaseUser.email],
+            set_={
+                'username': statement.excluded.username,
+                'password_hash': statement.excluded.password_hash,
+                'scope': statement.excluded.scope,
+                'max_owned_servers': statement.excluded.max_owned_servers,
+            },
+        )
+    )
     db.commit()
-    db.refresh(db_user)
-    return models.User.from_database_user(db_user)
+    _invalidate_users()
+    return models.User.model_construct(email=token_item.email, permissions=token_item.permissions, username=username, password_hash=password_hash)
 
 
 def create_token(db: Session, token: models.SignupToken):
-    db_signup = models.DatabaseSignupToken(email=token.email, scope=':'.join(token.permissions), token=token.token)
-    db.query(models.DatabaseSignupToken).filter(models.DatabaseSignupToken.email == token.email).delete()
-    db.add(db_signup)
+    statement = insert(models.DatabaseSignupToken).values(email=token.email, scope=list(token.permissions), token=token.token)
+    db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[models.DatabaseSignupToken.email],
+            set_={'token': statement.excluded.token, 'scope': statement.excluded.scope},
+        )
+    )
     db.commit()
-    db.refresh(db_signup)
-    return models.SignupToken.from_database_token(db_signup)
+    return token
 
 
 def change_server_nickname(db: Session, server_nickname: models.ServerNickname) -> models.ServerNickname:
-    db_server_nickname = models.DatabaseServerNickname(server_id=server_nickname.server_id, nickname=server_nickname.nickname)
-    db.query(models.DatabaseServerNickname).filter(models.DatabaseServerNickname.server_id == server_nickname.server_id).delete()
-    db.add(db_server_nickname)
+    statement = insert(models.DatabaseServerNickname).values(server_id=server_nickname.server_id, nickname=server_nickname.nickname)
+    db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[models.DatabaseServerNickname.server_id],
+            set_={'nickname': statement.excluded.nickname},
+        )
+    )
     db.commit()
-    db.refresh(db_server_nickname)
-    return models.ServerNickname.from_database_nickname(db_server_nickname)
+    SERVER_NICKNAME_CACHE.pop(server_nickname.server_id)
+    ALL_SERVER_NICKNAMES_CACHE.clear()
+    return server_nickname
 
 
 def get_server_nickname(db: Session, server_id: str) -> str:
-    db_server_nickname = db.query(models.DatabaseServerNickname).filter(models.DatabaseServerNickname.server_id == server_id).first()
-    return db_server_nickname.nickname
+    cached_nickname = SERVER_NICKNAME_CACHE.get(server_id)
+    if cached_nickname is not None:
+        return cached_nickname
+
+    nickname = db.execute(GET_SERVER_NICKNAME, {'server_id': server_id}).scalar_one()
+    return SERVER_NICKNAME_CACHE.set(server_id, nickname)
 
 
 def get_all_server_nicknames(db: Session) -> dict[str, str]:
-    return {db_server_nickname.server_id: db_server_nickname.nickname for db_server_nickname in db.query(models.DatabaseServerNickname).all()}
+    cached_nicknames = ALL_SERVER_NICKNAMES_CACHE.get(None)
+    if cached_nicknames is not None:
+        return cached_nicknames
+
+    result = db.execute(GET_ALL_SERVER_NICKNAMES)
+    return ALL_SERVER_NICKNAMES_CACHE.set(None, {server_id: nickname for partition in result.partitions() for server_id, nickname in partition})
 
 
 def set_server_permissions_for_user(db: Session, server_permissions: models.ServerPermissions):
-    db_server_permissiosn = models.DatabasePermissions(server_id=server_permissions.server_id, user_id=server_permissions.user_id, scope=':'.join(server_permissions.permissions))
-    db.query(models.DatabasePermissions).filter(models.DatabasePermissions.server_id == server_permissions.server_id, models.DatabasePermissions.user_id == server_permissions.user_id).delete()
-    db.add(db_server_permissiosn)
+    statement = insert(models.DatabasePermissions).values(
+        server_id=server_permissions.server_id, user_id=server_permissions.user_id, scope=list(server_permissions.permissions),
+    )
+    db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[models.DatabasePermissions.server_id, models.DatabasePermissions.user_id],
+            set_={'scope': statement.excluded.scope},
+        )
+    )
     db.commit()
-    db.refresh(db_server_permissiosn)
-    return models.ServerPermissions.from_database_permissions(db_server_permissiosn)
+    return server_permissions
 
 
 def get_server_permissions_for_user(db: Session, server_id: str, user_id: str) -> Optional[models.ServerPermissions]:
-    database_permissions = db.query(models.DatabasePermissions).filter(models.DatabasePermissions.server_id == server_id, models.DatabasePermissions.user_id == user_id).first()
+    database_permissions = db.execute(GET_SERVER_PERMISSIONS, {'server_id': server_id, 'user_id': user_id}).first()
     if database_permissions is not None:
-        return models.ServerPermissions.from_database_permissions(database_permissions=database_permissions)
+        return models.ServerPermissions.from_database_permissions(database_permissions)
     return None
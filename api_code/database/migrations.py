@@ -0,0 +1,32 @@
+from sqlalchemy import Engine, inspect, text
+
+from . import models
+
+SCOPE_TABLES = (models.DatabaseUser.__tablename__, models.DatabaseSignupToken.__tablename__, models.DatabasePermissions.__tablename__)
+
+
+def _rebuild_server_permissions(engine: Engine):
+    table = models.DatabasePermissions.__table__
+    if 'index' not in {column['name'] for column in inspect(engine).get_columns(table.name)}:
+        return
+
+    # Older databases keyed server_permissions by a surrogate autoincrement column, move the rows to the composite key
+    with engine.begin() as connection:
+        connection.execute(text(f'ALTER TABLE {table.name} RENAME TO {table.name}_old'))
+        table.create(connection)
+        # Legacy tables allowed duplicate (server_id, user_id) rows, keep the newest one
+        connection.execute(text(f'INSERT OR REPLACE INTO {table.name} (server_id, user_id, scope) SELECT server_id, user_id, scope FROM {table.name}_old ORDER BY "index"'))
+        connection.execute(text(f'DROP TABLE {table.name}_old'))
+
+
+def migrate(engine: Engine):
+    models.Base.metadata.create_all(bind=engine)
+    _rebuild_server_permissions(engine)
+
+    with engine.begin() as connection:
+        for table in SCOPE_TABLES:
+            # Scopes used to be stored as ':' separated strings, rewrite them as JSON arrays in place
+            connection.execute(text(
+                f'UPDATE {table} SET scope = CASE WHEN scope = \'\' THEN \'[]\' ELSE \'["\' || replace(scope, \':\', \'","\') || \'"]\' END '
+                'WHERE scope IS NOT NULL AND NOT json_valid(scope)'
+            ))
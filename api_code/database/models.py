@@ -1,10 +1,10 @@
 
 
 from enum import Enum
-from typing import Self
+from typing import Self, Union
 
 from pydantic import BaseModel, Field
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import JSON, Column, Integer, PrimaryKeyConstraint, Row, String
 
 from .database import Base
 
@@ -26,12 +26,11 @@ class UserBase(BaseModel):
     permissions: list[Permission] = Field(default_factory=list)
 
     @classmethod
-    def from_database_user(cls, database_user: 'DatabaseUser') -> Self:
-        permissions = database_user.scope.split(':')
-        return cls(
+    def from_database_user(cls, database_user: Union['DatabaseUser', Row]) -> Self:
+        return cls.model_construct(
             username=database_user.username,
             email=database_user.email,
-            permissions=permissions,
+            permissions=[Permission(permission) for permission in database_user.scope],
             max_owned_servers=database_user.max_owned_servers,
         )
 
@@ -39,12 +38,11 @@ class UserBase(BaseModel):
 class User(UserBase):
     password_hash: str
     @classmethod
-    def from_database_user(cls, database_user: 'DatabaseUser') -> Self:
-        permissions = database_user.scope.split(':')
-        return cls(
+    def from_database_user(cls, database_user: Union['DatabaseUser', Row]) -> Self:
+        return cls.model_construct(
             username=database_user.username,
             email=database_user.email,
-            permissions=permissions,
+            permissions=[Permission(permission) for permission in database_user.scope],
             password_hash=database_user.password_hash,
             max_owned_servers=database_user.max_owned_servers,
         )
@@ -56,7 +54,7 @@ class DatabaseUser(Base):
     username = Column(String, primary_key=True, index=True)
     email = Column(String, unique=True, index=True)
     password_hash = Column(String)
-    scope = Column(String)
+    scope = Column(JSON)
     max_owned_servers=Column(Integer, default=5)
     
 
@@ -65,7 +63,7 @@ class DatabaseSignupToken(Base):
     
     token = Column(String, primary_key=True, unique=True, index=True)
     email = Column(String, unique=True, index=True)
-    scope = Column(String)
+    scope = Column(JSON)
     
 
 class SignupToken(BaseModel):
@@ -74,11 +72,10 @@ class SignupToken(BaseModel):
     permissions: list[Permission]
 
     @classmethod
-    def from_database_token(cls, database_token: DatabaseSignupToken) -> Self:
-        permissions = database_token.scope.split(':')
-        return cls(
+    def from_database_token(cls, database_token: Union[DatabaseSignupToken, Row]) -> Self:
+        return cls.model_construct(
             email=database_token.email,
-            permissions=permissions,
+            permissions=[Permission(permission) for permission in database_token.scope],
             token=database_token.token,
         )
     
@@ -89,10 +86,10 @@ class DatabaseServerNickname(Base):
 
 class DatabasePermissions(Base):
     __tablename__ = 'server_permissions'
-    index = Column(Integer, index=True, unique=True, autoincrement=True, primary_key=True)
-    server_id = Column(String, index=True)
-    user_id = Column(String, index=True)
-    scope = Column(String)
+    __table_args__ = (PrimaryKeyConstraint('server_id', 'user_id'),)
+    server_id = Column(String)
+    user_id = Column(String)
+    scope = Column(JSON)
 
 
 class ServerNickname(BaseModel):
@@ -100,8 +97,8 @@ class ServerNickname(BaseModel):
     nickname: str
 
     @classmethod
-    def from_database_nickname(cls, database_nickname: DatabaseServerNickname) -> Self:
-        return cls(
+    def from_database_nickname(cls, database_nickname: Union[DatabaseServerNickname, Row]) -> Self:
+        return cls.model_construct(
             server_id=database_nickname.server_id,
             nickname=database_nickname.nickname,
         )
@@ -112,10 +109,9 @@ class ServerPermissions(BaseModel):
     permissions: list[Permission] = Field(default_factory=list)
 
     @classmethod
-    def from_database_permissions(cls, database_permissions: DatabasePermissions) -> Self:
-        permissions = database_permissions.scope.split(':')
-        return cls(
+    def from_database_permissions(cls, database_permissions: Union[DatabasePermissions, Row]) -> Self:
+        return cls.model_construct(
             server_id=database_permissions.server_id,
             user_id=database_permissions.user_id,
-            permissions=permissions,
-        )
\ No newline at end of file
+            permissions=[Permission(permission) for permission in database_permissions.scope],
+        )
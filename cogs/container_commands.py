@@ -1,7 +1,12 @@
+import asyncio
+import hashlib
+import inspect
+import json
 import logging
 import secrets
-import string
-from typing import Optional, Union
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Iterable, Optional, TypeVar, Union
 
 import bcrypt
 import discord
@@ -11,18 +16,36 @@ from discord.ext import commands
 from docker_runner.docker_runner import DOMAIN, DockerRunner
 from docker_runner.container_runner.container_runner_interface import ContainerRunner, ImageInfo, Port, PortProtocol, ServerInfo
 from docker_runner.upnp_wrapper import UpnpClient
+from ttl_cache import TTLCache
 
 MAX_MESSAGE_SIZE = 2000
+MAX_AUTOCOMPLETE_CHOICES = 25
+USER_CACHE_TTL = 600
+UNKNOWN_USER_CACHE_TTL = 60
+LISTING_CACHE_TTL = 1.5
+STALE_LISTING_TTL = 300
+FILE_BROWSER_BCRYPT_ROUNDS = 10
+SYNC_HASH_PATH = Path(__file__).resolve().parent.parent / '.sync_hash'
+COMMAND_TO_DICT_TAKES_TREE = 'tree' in inspect.signature(app_commands.Command.to_dict).parameters
+
+T = TypeVar('T')
 
 
 class ContainerCommands(commands.Cog):
     def __init__(self, bot: commands.Bot, container_runner: Optional[ContainerRunner] = None, main_domain: str = DOMAIN, **kwargs):
         if not container_runner:
-            container_runner = DockerRunner(domain=main_domain)
+            container_runner = DockerRunner(domain=main_domain, watch_image_events=True)
         self.container_runner = container_runner
         self.bot = bot
         self._main_domain = main_domain
-        self._upnp = UpnpClient()
+        self._upnp = UpnpClient(container_runner=self.container_runner)
+        self._user_cache: TTLCache[str, discord.User] = TTLCache(ttl=USER_CACHE_TTL, maxsize=4096)
+        self._unknown_user_cache: TTLCache[str, bool] = TTLCache(ttl=UNKNOWN_USER_CACHE_TTL, maxsize=4096)
+        self._listing_cache: TTLCache[tuple, list] = TTLCache(ttl=LISTING_CACHE_TTL, maxsize=1024)
+        self._stale_listings: TTLCache[tuple, list] = TTLCache(ttl=STALE_LISTING_TTL, maxsize=1024)
+        self._listing_refreshes: dict[tuple, asyncio.Task] = {}
+        self._listing_generation = 0
+        self._server_search_names: dict[tuple[str, bool], str] = {}
         super().__init__(**kwargs)
 
     @app_commands.command(name='create', description='This will create a new minecraft server')
@@ -32,8 +55,9 @@ class ContainerCommands(commands.Cog):
     async def create(self, interaction: Interaction, game: str):
         user_id = str(interaction.user.id)
         try:
-            server_info: ServerInfo = self.container_runner.create_game_server(user_id=user_id, image_id=game)
-            display_name = self.format_display_name(server_info)
+            server_info: ServerInfo = await asyncio.to_thread(self.container_runner.create_game_server, user_id=user_id, image_id=game)
+            self._invalidate_listings()
+            display_name = await self.format_display_name(server_info)
             await interaction.response.send_message(
                 f'Created server {display_name}', ephemeral=True
             )
@@ -47,12 +71,11 @@ class ContainerCommands(commands.Cog):
     @app_commands.describe(game='The game server to browse it\'s files')
     async def start_browsing(self, interaction: Interaction, game: str):
         user_id = interaction.user.id
-        alphabet = string.ascii_letters + string.digits + string.punctuation
-        alphabet = ''.join(x for x in alphabet if x != '`')
-        password = ''.join([secrets.choice(alphabet) for _ in range(12)])
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        password = secrets.token_urlsafe(12)
+        hashed_password = (await asyncio.to_thread(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt(rounds=FILE_BROWSER_BCRYPT_ROUNDS))).decode('utf-8')
 
-        file_browser_info = self.container_runner.start_file_browser(owner_id=str(user_id), server_id=game, hashed_password=hashed_password)
+        file_browser_info = await asyncio.to_thread(self.container_runner.start_file_browser, owner_id=str(user_id), server_id=game, hashed_password=hashed_password)
+        self._invalidate_listings()
 
         available_access_points = f'https://{file_browser_info.url}'
 
@@ -63,7 +86,8 @@ class ContainerCommands(commands.Cog):
     @app_commands.guilds(1013092707494809700)
     async def stop_browsing(self, interaction: Interaction, game: Optional[str] = None):
         user_id = interaction.user.id
-        self.container_runner.stop_file_browsing_by_user_and_server(user_id=str(user_id), server_id=game)
+        await asyncio.to_thread(self.container_runner.stop_file_browsing_by_user_and_server, user_id=str(user_id), server_id=game)
+        self._invalidate_listings()
         await interaction.response.send_message('Stopped file browser', ephemeral=True)
 
     @app_commands.command(name='delete', description='This will create a new minecraft server')
@@ -72,8 +96,10 @@ class ContainerCommands(commands.Cog):
     @app_commands.describe(game='Game Server')
     async def delete(self, interaction: Interaction, game: str):
         try:
-            server_info = self.container_runner.get_server_info(server_id=game)
-            self.container_runner.delete_game_server(server_id=server_info.id_)
+            server_info = await asyncio.to_thread(self.container_runner.get_server_info, server_id=game)
+            await asyncio.to_thread(self.container_runner.delete_game_server, server_id=server_info.id_)
+            self._invalidate_listings()
+            await asyncio.to_thread(self._upnp.remove_port_mappings, server_id=server_info.id_)
             await interaction.response.send_message(f'Deleted game {await self.format_display_name(info=server_info)}', ephemeral=True)
         except Exception as e:
             logging.error(f'Failed to delete container: {e}', exc_info=True)
@@ -84,7 +110,7 @@ class ContainerCommands(commands.Cog):
     @app_commands.guilds(1013092707494809700)
     @app_commands.describe(command='command to run')
     async def run_command(self, interaction: Interaction, game: str, command: str):
-        response = self.container_runner.run_command(server_id=game, command=command)
+        response = await asyncio.to_thread(self.container_runner.run_command, server_id=game, command=command)
         if not response:
             await interaction.response.send_message('No output was found')
             return
@@ -94,7 +120,7 @@ class ContainerCommands(commands.Cog):
     @app_commands.checks.has_permissions(administrator=True)
     @app_commands.guilds(1013092707494809700)
     async def get_server_ports(self, interaction: Interaction, game: str):
-        info = self.container_runner.get_server_info(server_id=game)
+        info = await asyncio.to_thread(self.container_runner.get_server_info, server_id=game)
         if info.ports is None:
             await interaction.response.send_message('Failed to get server ports')
             return
@@ -106,18 +132,34 @@ class ContainerCommands(commands.Cog):
     @app_commands.checks.has_permissions(administrator=True)
     @app_commands.guilds(1013092707494809700)
     async def get_server_logs(self, interaction: Interaction, game: str):
-        server_info = self.container_runner.get_server_info(server_id=game)
+        server_info = await asyncio.to_thread(self.container_runner.get_server_info, server_id=game)
         prefix = f'***{await self.format_display_name(server_info)} Logs***\n'
         max_log_size = MAX_MESSAGE_SIZE - len(prefix)
-        logs = self.container_runner.get_server_logs(server_id=server_info.id_, lines_limit=max_log_size)
+        logs = await asyncio.to_thread(self.container_runner.get_server_logs, server_id=server_info.id_, lines_limit=max_log_size)
 
         if len(logs) > max_log_size:
             logs = logs[-max_log_size:]
         await interaction.response.send_message(prefix + logs, ephemeral=True)
 
     @commands.command(name='sync')
-    async def sync(self, ctx: commands.Context, guild: Optional[discord.Guild] = None):
+    async def sync(self, ctx: commands.Context, guild: Optional[discord.Guild] = None, force: bool = False):
+        tree_key = str(guild.id) if guild is not None else 'global'
+        tree_hash = self._command_tree_hash(guild)
+        synced_hashes = json.loads(SYNC_HASH_PATH.read_text()) if SYNC_HASH_PATH.exists() else {}
+        if not force and synced_hashes.get(tree_key) == tree_hash:
+            return
+
         await self.bot.tree.sync(guild=guild)
+        synced_hashes[tree_key] = tree_hash
+        SYNC_HASH_PATH.write_text(json.dumps(synced_hashes))
+
+    def _command_tree_hash(self, guild: Optional[discord.Guild]) -> str:
+        tree = self.bot.tree
+        if COMMAND_TO_DICT_TAKES_TREE:
+            payload = [command.to_dict(tree) for command in tree.get_commands(guild=guild)]
+        else:
+            payload = [command.to_dict() for command in tree.get_commands(guild=guild)]
+        return hashlib.blake2b(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
 
     @app_commands.command(name='start')
     @app_commands.checks.has_permissions(administrator=True)
@@ -130,33 +172,24 @@ class ContainerCommands(commands.Cog):
     async def start_container(self, interaction: discord.Interaction, game: str, server_ports: Optional[str] = None, command_parameters: Optional[str] = None):
         if server_ports is not None:
             formatted_ports = {}
-            for ports in server_ports.split(' '):
-                ports = server_ports.split('/')
-                if len(ports) == 2:
-                    ports, protocol = ports
-                else:
-                    ports = ports[0]
-                    protocol = PortProtocol.TCP
-
-                ports = ports.split(':')
-                if len(ports) == 2:
-                    server_port, target_port = ports
-                else:
-                    server_port = ports[0]
-                    target_port = None
-
-                formatted_ports[Port(number=int(server_port), protocol=PortProtocol(protocol))] = (
-                    Port(number=int(target_port), protocol=PortProtocol(protocol)) if target_port is not None else None
+            for port_spec in server_ports.split():
+                port_spec, _, protocol = port_spec.partition('/')
+                protocol = PortProtocol(protocol) if protocol else PortProtocol.TCP
+                server_port, _, target_port = port_spec.partition(':')
+
+                formatted_ports[Port(number=int(server_port), protocol=protocol)] = (
+                    Port(number=int(target_port), protocol=protocol) if target_port else None
                 )
         else:
             formatted_ports = None
 
-        server_info = self.container_runner.start_game_server(server_id=game, ports=formatted_ports, command_parameters=command_parameters)
+        server_info = await asyncio.to_thread(self.container_runner.start_game_server, server_id=game, ports=formatted_ports, command_parameters=command_parameters)
+        self._invalidate_listings()
         if server_info.ports is None:
             await interaction.response.send_message('Failed to get server ports')
             return
         
-        self._upnp.add_port_mapping_using_server_info(server_info=server_info)
+        server_info = await asyncio.to_thread(self._upnp.add_port_mapping_using_server_info, server_info=server_info)
         
         available_access_points = {f'{self._main_domain}:{port.number}/{port.protocol.value}' for port in server_info.ports}
 
@@ -169,8 +202,11 @@ class ContainerCommands(commands.Cog):
         game='What server to stop',
     )
     async def stop_container(self, interaction: discord.Interaction, game: str):
-        info = self.container_runner.stop_game_server(server_id=game)
-        server_display_name = self.format_display_name(info)
+        info = await asyncio.to_thread(self.container_runner.stop_game_server, server_id=game)
+        self._invalidate_listings()
+        if not info.on:
+            await asyncio.to_thread(self._upnp.remove_port_mappings, server_id=info.id_)
+        server_display_name = await self.format_display_name(info)
         if info.on:
             await interaction.response.send_message(f'Failed to stop server {server_display_name}')
         else:
@@ -178,85 +214,136 @@ class ContainerCommands(commands.Cog):
 
     @create.autocomplete('game')
     async def auto_complete_all_images(self, interaction: Interaction, current: str):
-        image_info_list = self.container_runner.list_images()
+        image_info_list = await self._cached_listing(self.container_runner.list_images)
+        current = current.lower()
+        matching_images = (image_info for image_info in image_info_list if current in image_info.search_name)
         return [
-            Choice(name=await self.format_display_name(info=image_info), value=image_info.id_)
-            for image_info in image_info_list
-            if image_info.name.replace(':', ' ').replace('/', ' ').replace('-', ' ').index(current) != -1
+            Choice(name=image_info.display_name, value=image_info.id_)
+            for image_info in islice(matching_images, MAX_AUTOCOMPLETE_CHOICES)
         ]
 
     async def format_display_name(self, info: Union[ServerInfo, ImageInfo]):
         if isinstance(info, ImageInfo):
-            new_container_name = f"{info.name.replace('-', ' ')} {info.version}".title()
-            return new_container_name
+            return info.display_name
+
+        return self._format_server_display_name(info, await self._fetch_user(info.user_id))
+
+    @staticmethod
+    def _format_server_display_name(info: ServerInfo, user: Optional[discord.User]) -> str:
+        if user is None:
+            return f'{info.user_id}\'s {info.image.display_name}'
+        return f'{user.name}#{user.discriminator}\'s {info.image.display_name}'
+
+    async def _fetch_user(self, user_id: str) -> Optional[discord.User]:
+        user = self._user_cache.get(user_id)
+        if user is not None or self._unknown_user_cache.get(user_id):
+            return user
 
-        else:
-            new_container_name = f"{info.image.name.replace('-', ' ')} {info.image.version}".title()
         try:
-            user = await self.bot.fetch_user(int(info.user_id))
-            return f'{user.name}#{user.discriminator}\'s {new_container_name}'
-        except:
-            return f'{info.user_id}\'s {new_container_name}'
+            discord_user_id = int(user_id)
+            user = self.bot.get_user(discord_user_id) or await self.bot.fetch_user(discord_user_id)
+        except Exception:
+            self._unknown_user_cache.set(user_id, True)
+            return None
+        return self._user_cache.set(user_id, user)
+
+    async def _fetch_users(self, user_ids: Iterable[str]) -> dict[str, Optional[discord.User]]:
+        async with asyncio.TaskGroup() as task_group:
+            tasks = {user_id: task_group.create_task(self._fetch_user(user_id)) for user_id in set(user_ids)}
+        return {user_id: task.result() for user_id, task in tasks.items()}
+
+    async def _cached_listing(self, list_function: Callable[..., list[T]], **kwargs: Optional[str]) -> list[T]:
+        key = (list_function.__name__, tuple(sorted(kwargs.items())))
+        listing = self._listing_cache.get(key)
+        if listing is not None:
+            return listing
+
+        listing = self._stale_listings.get(key)
+        if listing is None:
+            return await self._refresh_listing(key, list_function, kwargs)
+
+        if key not in self._listing_refreshes:
+            self._listing_refreshes[key] = asyncio.create_task(self._refresh_listing_in_background(key, list_function, kwargs))
+        return listing
+
+    async def _refresh_listing(self, key: tuple, list_function: Callable[..., list[T]], kwargs: dict[str, Optional[str]]) -> list[T]:
+        generation = self._listing_generation
+        listing = await asyncio.to_thread(list_function, **kwargs)
+        if generation == self._listing_generation:
+            self._stale_listings.set(key, listing)
+            self._listing_cache.set(key, listing)
+        return listing
+
+    async def _refresh_listing_in_background(self, key: tuple, list_function: Callable[..., list], kwargs: dict[str, Optional[str]]):
+        try:
+            await self._refresh_listing(key, list_function, kwargs)
+        except Exception as e:
+            logging.error(f'Failed to refresh {key[0]}: {e}', exc_info=True)
+        finally:
+            self._listing_refreshes.pop(key, None)
+
+    def _invalidate_listings(self):
+        self._listing_generation += 1
+        self._listing_cache.clear()
+        self._stale_listings.clear()
+        self._server_search_names.clear()
+
+    def _get_known_user(self, user_id: str) -> Optional[discord.User]:
+        user = self._user_cache.get(user_id)
+        if user is None and user_id.isdigit():
+            user = self.bot.get_user(int(user_id))
+        return user
+
+    def _server_search_name(self, server: ServerInfo) -> str:
+        user = self._get_known_user(server.user_id)
+        key = (server.id_, user is not None)
+        search_name = self._server_search_names.get(key)
+        if search_name is None:
+            search_name = self._server_search_names[key] = f'{self._format_server_display_name(server, user)} {server.id_}'.lower()
+        return search_name
+
+    async def _server_choices(self, servers: list[ServerInfo], current: str) -> list[Choice[str]]:
+        current = current.lower()
+        candidates = list(islice((server for server in servers if current in self._server_search_name(server)), MAX_AUTOCOMPLETE_CHOICES))
+        users = await self._fetch_users(server.user_id for server in candidates)
+        return [Choice(name=self._format_server_display_name(server, users[server.user_id]), value=server.id_) for server in candidates]
 
     @start_container.autocomplete('game')
     async def autocomplete_all_stopped_containers(self, interaction: Interaction, current: str):
-        servers = self.container_runner.list_servers()
-        choices = []
-        for server in (server for server in servers if not server.on):
-            display_name = await self.format_display_name(server)
-            if current.lower() in display_name.lower():
-                choices.append(Choice(name=display_name, value=server.id_))
-        return choices
+        servers = [server for server in await self._cached_listing(self.container_runner.list_servers) if not server.on]
+        return await self._server_choices(servers, current)
 
     @start_browsing.autocomplete('game')
     async def autocomplete_all_potential_file_browsers(self, interaction: Interaction, current: str):
-        servers = self.container_runner.list_servers()
-        file_browsers = self.container_runner.list_file_browser_servers(user_id=str(interaction.user.id))
-        choices = []
-        for server in servers:
-            if server.id_ in (fb.connected_to.id_ for fb in file_browsers):
-                continue
-            display_name = await self.format_display_name(server)
-            if current.lower() in display_name.lower():
-                choices.append(Choice(name=display_name, value=server.id_))
-        return choices
+        async with asyncio.TaskGroup() as task_group:
+            servers_task = task_group.create_task(self._cached_listing(self.container_runner.list_servers))
+            file_browsers_task = task_group.create_task(
+                self._cached_listing(self.container_runner.list_file_browser_servers, user_id=str(interaction.user.id))
+            )
+        servers, file_browsers = servers_task.result(), file_browsers_task.result()
+        browsed_server_ids = {file_browser.connected_to.id_ for file_browser in file_browsers}
+        servers = [server for server in servers if server.id_ not in browsed_server_ids]
+        return await self._server_choices(servers, current)
 
     @stop_browsing.autocomplete('game')
     async def autocomplete_all_filebrowsers(self, interaction: Interaction, current: str):
-        file_browsers = self.container_runner.list_file_browser_servers(user_id=str(interaction.user.id))
-        choices = []
-        for server in file_browsers:
-            display_name = await self.format_display_name(server.connected_to)
-            if current.lower() in display_name.lower():
-                choices.append(Choice(name=display_name, value=server.connected_to.id_))
-        return choices
+        file_browsers = await self._cached_listing(self.container_runner.list_file_browser_servers, user_id=str(interaction.user.id))
+        return await self._server_choices([server.connected_to for server in file_browsers], current)
 
     @delete.autocomplete('game')
     async def autocomplete_user_containers(self, interaction: Interaction, current: str):
         userid = interaction.user.id
-        servers = self.container_runner.list_servers(user_id=userid)
-        choices = []
-        for server in servers:
-            display_name = await self.format_display_name(server)
-            if current.lower() in display_name.lower():
-                choices.append(Choice(name=display_name, value=server.id_))
-        return choices
+        servers = await self._cached_listing(self.container_runner.list_servers, user_id=str(userid))
+        return await self._server_choices(servers, current)
 
     @run_command.autocomplete('game')
     @get_server_ports.autocomplete('game')
     @get_server_logs.autocomplete('game')
     @stop_container.autocomplete('game')
     async def autocomplete_user_active_containers(self, interaction: Interaction, current: str):
-        servers = self.container_runner.list_servers()
-        choices = []
-        for server in servers:
-            if not server.on:
-                continue
-            display_name = await self.format_display_name(server)
-            if current.lower() in display_name.lower():
-                choices.append(Choice(name=display_name, value=server.id_))
-        return choices
+        servers = [server for server in await self._cached_listing(self.container_runner.list_servers) if server.on]
+        return await self._server_choices(servers, current)
 
 
 async def setup(bot: commands.Bot, domain: str, cert_path: str, key_path: str):
-    await bot.add_cog(ContainerCommands(bot=bot, main_domain=domain, ))
+    await bot.add_cog(await asyncio.to_thread(ContainerCommands, bot=bot, main_domain=domain))
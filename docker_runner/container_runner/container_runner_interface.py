@@ -1,9 +1,12 @@
 import abc
 from enum import Enum
+from functools import cached_property
 from typing import Optional, List, Protocol, Union
 
 from pydantic import BaseModel, Field, computed_field
 
+IMAGE_NAME_SEPARATORS = str.maketrans('-:/', '   ')
+
 
 class PortProtocol(str, Enum):
     TCP = 'tcp'
@@ -20,7 +23,7 @@ class Port(BaseModel):
     protocol: PortProtocol
 
     @computed_field()
-    @property
+    @cached_property
     def id_(self) -> str:
         return f'{self.number}/{self.protocol.value}'
 
@@ -31,17 +34,21 @@ class Port(BaseModel):
 class ImageInfo(BaseModel):
     name: str
     version: str
-    ports: set[Port] = Field(default_factory=set)
+    ports: frozenset[Port] = Field(default_factory=frozenset)
 
     @computed_field()
-    @property
+    @cached_property
     def id_(self) -> str:
         return f'{self.name}:{self.version}'
     
     @computed_field()
-    @property
+    @cached_property
     def display_name(self) -> str:
-        return f'{self.name} {self.version}'.title()
+        return f'{self.name.translate(IMAGE_NAME_SEPARATORS)} {self.version}'.title()
+
+    @cached_property
+    def search_name(self) -> str:
+        return self.name.translate(IMAGE_NAME_SEPARATORS).lower()
 
 
 class ServerInfo(BaseModel):
@@ -66,6 +73,8 @@ class FileBrowserInfo(BaseModel):
 
 
 class ContainerRunner(Protocol):
+    __slots__ = ()
+
     @abc.abstractmethod
     def get_image_info(self, image_id: str) -> ImageInfo:
         ...
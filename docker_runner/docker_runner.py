@@ -1,35 +1,86 @@
-import os
+import logging
 import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 from pydantic import BaseModel
 
 import chardet
 import docker
-import select
-from typing import Literal, Optional, List, Union, cast
+from typing import Callable, Optional, List, Union, cast
+from docker.errors import NotFound
 from docker.models.containers import Container
 from docker.models.images import Image
 from docker.models.volumes import Volume
 from docker.types import Mount
 from docker_runner.container_runner.container_runner_interface import ContainerRunner, FileBrowserInfo, ImageInfo, Port, ServerInfo, ServerType
 from pathlib import Path
-from time import sleep
+from ttl_cache import TTLCache
 
 GAMES_REPOSITORY = 'games'
 FILE_BROWSER_PREFIX = 'filebrowser'
 FILE_BROWSER_IMAGE = 'filebrowser/filebrowser'
 
-ANSI_ESCAPE = re.compile(br'(?:\x1B[@-Z\\-_]|[\x80-\x9A\x9C-\x9F]|(?:\x1B\[|\x9B)[0-?]*[ -/]*[@-~])')
+ANSI_ESCAPE = re.compile(br'\r|\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
 
-PORTS_FORMAT = re.compile(r'(?P<port>\d+)(?:/(?P<protocol>\w+))?(?::(?P<destination>\d+))?')
+DOCKER_MAX_POOL_SIZE = 32
+MAX_SERVERS_PER_GAME = 5
+IMAGE_CACHE_TTL = 10
+WATCHED_IMAGE_CACHE_TTL = 600
+IMAGE_EVENTS_RETRY_DELAY = 5
+PORTS_POLL_INITIAL_DELAY = 0.005
+PORTS_POLL_MAX_DELAY = 0.1
+ENCODING_DETECTION_PREFIX_SIZE = 32 * 1024
+COMMAND_OUTPUT_MAX_LINES = 20
+COMMAND_OUTPUT_CHUNK_SIZE = 64 * 1024
+COMMAND_FIRST_OUTPUT_TIMEOUT = 0.5
+COMMAND_OUTPUT_IDLE_TIMEOUT = 0.1
+COMMAND_OUTPUT_DEADLINE = 1.0
+MAX_CONCURRENT_CONTAINER_OPERATIONS = 8
+
+
+@lru_cache(maxsize=2048)
+def _parse_port(port_id: str) -> Port:
+    port_number, protocol = port_id.split('/')
+    return Port(number=port_number, protocol=protocol)
+
+
+def _for_each_container(containers: list[Container], operation: Callable[[Container], object]):
+    if len(containers) <= 1:
+        for container in containers:
+            operation(container)
+        return
+
+    with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_CONTAINER_OPERATIONS, len(containers))) as executor:
+        list(executor.map(operation, containers))
+
+
+def _strip_ansi(data: Union[bytes, bytearray]) -> Union[bytes, bytearray]:
+    if b'\x1b' not in data:
+        return data.replace(b'\r', b'')
+
+    stripped = bytearray()
+    view = memoryview(data)
+    position = 0
+    for match in ANSI_ESCAPE.finditer(data):
+        stripped += view[position:match.start()]
+        position = match.end()
+    stripped += view[position:]
+    return stripped
 
 
 def _convert_to_string(byte_str: Union[bytes, bytearray]) -> str:
-    encoding = chardet.detect(byte_str).get('encoding')
+    try:
+        return byte_str.decode('utf-8')
+    except UnicodeDecodeError:
+        pass
+
+    encoding = chardet.detect(bytes(byte_str[:ENCODING_DETECTION_PREFIX_SIZE])).get('encoding')
     if encoding:
-        return byte_str.decode(encoding)
-    return byte_str.decode()
+        return byte_str.decode(encoding, errors='replace')
+    return byte_str.decode('utf-8', errors='replace')
 
 
 class GameNotFound(Exception):
@@ -75,7 +126,26 @@ def create_labels_filter(**kwargs: Optional[str]) -> list[str]:
     return [f'{key}={value}' if value is not None else f'{key}' for key, value in kwargs.items()]
 
 
+GAME_IMAGES_LABELS_FILTER = create_labels_filter(type=ServerType.GAME.value)
+
+
 class DockerRunner(ContainerRunner):
+    __slots__ = (
+        'docker',
+        '_filebrowser_image',
+        '_filebrowser_image_ready',
+        '_filebrowser_image_lock',
+        '_cert_path',
+        '_key_path',
+        '_domain',
+        '_browsers_domain',
+        '_image_list_cache',
+        '_image_info_cache',
+        '_image_working_dir_cache',
+        '_browser_network',
+        '_nginx',
+    )
+
     def __init__(
         self,
         docker_client: Optional[docker.DockerClient] = None,
@@ -83,20 +153,25 @@ class DockerRunner(ContainerRunner):
         cert_path: Optional[str] = None,
         key_path: Optional[str] = None,
         domain: str = DOMAIN,
+        watch_image_events: bool = False,
     ):
         if not docker_client:
-            docker_client = docker.from_env()
+            docker_client = docker.from_env(max_pool_size=DOCKER_MAX_POOL_SIZE)
         self.docker = docker_client
-        
-        try:
-            self.docker.images.get(filebrowser_repository)
-        except Exception as e:
-            self.docker.images.pull(repository=filebrowser_repository)
 
         self._filebrowser_image = filebrowser_repository
+        self._filebrowser_image_ready = False
+        self._filebrowser_image_lock = threading.Lock()
         self._cert_path = cert_path
         self._key_path = key_path
         self._domain = domain
+        self._browsers_domain = f'browsers.{domain}'
+        image_cache_ttl = WATCHED_IMAGE_CACHE_TTL if watch_image_events else IMAGE_CACHE_TTL
+        self._image_list_cache: TTLCache[None, list[ImageInfo]] = TTLCache(ttl=image_cache_ttl)
+        self._image_info_cache: TTLCache[str, ImageInfo] = TTLCache(ttl=image_cache_ttl, maxsize=256)
+        self._image_working_dir_cache: TTLCache[str, str] = TTLCache(ttl=image_cache_ttl, maxsize=256)
+        if watch_image_events:
+            threading.Thread(target=self._watch_image_events, name='docker-image-events', daemon=True).start()
         try:
             self._browser_network = self.docker.networks.get('browsers')
         except:
@@ -108,6 +183,34 @@ class DockerRunner(ContainerRunner):
 
         if self._nginx is None:
             self._nginx = self.docker.containers.run(image='nginx:latest', detach=True, name='browsers-nginx', ports={'80/tcp': ('127.0.0.1', '4080/tcp')}, network='browsers', mounts=[Mount(target='/etc/nginx/conf.d/default.conf', source=str(Path(__file__).parent/'nginx.conf'), read_only=True, type='bind')])
+
+    def _watch_image_events(self):
+        while True:
+            try:
+                for _ in self.docker.events(decode=True, filters={'type': 'image'}):
+                    self._invalidate_image_caches()
+            except Exception as e:
+                logging.error(f'Docker image event stream failed: {e}', exc_info=True)
+            self._invalidate_image_caches()
+            time.sleep(IMAGE_EVENTS_RETRY_DELAY)
+
+    def _invalidate_image_caches(self):
+        self._image_list_cache.clear()
+        self._image_info_cache.clear()
+        self._image_working_dir_cache.clear()
+
+    def _ensure_filebrowser_image(self):
+        if self._filebrowser_image_ready:
+            return
+
+        with self._filebrowser_image_lock:
+            if self._filebrowser_image_ready:
+                return
+            try:
+                self.docker.images.get(self._filebrowser_image)
+            except Exception as e:
+                self.docker.images.pull(repository=self._filebrowser_image)
+            self._filebrowser_image_ready = True
     
 
     def _get_server_container(self, server_info: ServerInfo, server_type: ServerType, user_id: Optional[str] = None) -> Optional[Container]:
@@ -122,6 +225,7 @@ class DockerRunner(ContainerRunner):
                         user_id=user_id,
                     ),
                 },
+                sparse=True,
             ),
         )
 
@@ -134,6 +238,10 @@ class DockerRunner(ContainerRunner):
         return container_list[0]
 
     def get_server_info(self, server_id: str, user_id: Optional[str] = None) -> ServerInfo:
+        server_info, _ = self._get_server_info_and_container(server_id=server_id, user_id=user_id)
+        return server_info
+
+    def _get_server_info_and_container(self, server_id: str, user_id: Optional[str] = None) -> tuple[ServerInfo, Optional[Container]]:
         volume: Optional[Volume] = cast(Optional[Volume], self.docker.volumes.get(server_id))
         if volume is None:
             raise ServerNotFound()
@@ -141,50 +249,104 @@ class DockerRunner(ContainerRunner):
         if volume.attrs is None:
             raise ServerNotFound('Volume has no attrs')
 
-        volume_labels = VolumeLabels(**volume.attrs.get('Labels', {}))
+        volume_labels = VolumeLabels.model_validate(volume.attrs.get('Labels', {}))
         image = self.get_image_info(image_id=volume_labels.image_id)
         if image is None:
             raise GameNotFound()
 
 
-        server_info = ServerInfo(id_=str(volume.id), user_id=volume_labels.user_id, image=image, on=False)
+        server_info = ServerInfo.model_construct(id_=str(volume.id), user_id=volume_labels.user_id, image=image, on=False)
 
         container = self._get_server_container(server_info=server_info, user_id=user_id, server_type=ServerType.GAME)
 
         if container is None:
-            return server_info
+            return server_info, None
 
-        return ServerInfo(
+        return ServerInfo.model_construct(
             id_=str(volume.id),
             user_id=volume_labels.user_id,
             image=image,
             on=True,
             domain=self._domain,
-            ports=self._extract_ports_from_container(container=container),
-        )
+            ports=set(self._extract_ports_from_container_summary(container.attrs)),
+        ), container
 
     def list_servers(self, user_id: Optional[str] = None, image_id: Optional[str] = None) -> List[ServerInfo]:
-        volumes = self.docker.volumes.list(filters={'label': create_labels_filter(user_id=user_id, image_id=image_id)})
-        return [self.get_server_info(str(volume.id)) for volume in volumes]
+        volumes = cast(list[Volume], self.docker.volumes.list(filters={'label': create_labels_filter(user_id=user_id, image_id=image_id)}))
+        containers = cast(
+            list[Container],
+            self.docker.containers.list(filters={'label': create_labels_filter(user_id=user_id, image_id=image_id, type=ServerType.GAME.value)}, sparse=True),
+        )
+        running_containers = {container.attrs.get('Labels', {}).get('volume_id'): container for container in containers}
+        images: dict[str, ImageInfo] = {}
+
+        server_info_list: list[ServerInfo] = []
+        for volume in volumes:
+            assert volume.attrs is not None, 'Volume.attrs was None'
+
+            volume_labels = VolumeLabels.model_validate(volume.attrs.get('Labels', {}))
+            image = images.get(volume_labels.image_id)
+            if image is None:
+                image = images[volume_labels.image_id] = self.get_image_info(image_id=volume_labels.image_id)
+
+            container = running_containers.get(str(volume.id))
+            if container is None:
+                server_info_list.append(ServerInfo.model_construct(id_=str(volume.id), user_id=volume_labels.user_id, image=image, on=False))
+                continue
+
+            server_info_list.append(
+                ServerInfo.model_construct(
+                    id_=str(volume.id),
+                    user_id=volume_labels.user_id,
+                    image=image,
+                    on=True,
+                    domain=self._domain,
+                    ports=set(self._extract_ports_from_container_summary(container.attrs)),
+                )
+            )
+
+        return server_info_list
+
+    def count_servers(self, user_id: Optional[str] = None, image_id: Optional[str] = None) -> int:
+        return len(self.docker.volumes.list(filters={'label': create_labels_filter(user_id=user_id, image_id=image_id)}))
 
     def list_images(self) -> List[ImageInfo]:
-        images = cast(list[Image], self.docker.images.list(filters={'label': create_labels_filter(type=ServerType.GAME.value)}))
+        cached_image_info_list = self._image_list_cache.get(None)
+        if cached_image_info_list is not None:
+            return cached_image_info_list
+
+        images = cast(list[Image], self.docker.images.list(filters={'label': GAME_IMAGES_LABELS_FILTER}))
 
         image_info_list: list[ImageInfo] = []
 
         for image in images:
-            image_info_list.extend(self._extract_image_info_from_image(image))
+            image_info_list.extend(self._cache_image(image))
 
-        return image_info_list
+        return self._image_list_cache.set(None, image_info_list)
 
     def get_image_info(self, image_id: str) -> ImageInfo:
+        cached_image_info = self._image_info_cache.get(image_id)
+        if cached_image_info is not None:
+            return cached_image_info
+
         image: Optional[Image] = cast(Optional[Image], self.docker.images.get(image_id))
         if image is None:
             raise GameNotFound()
 
-        image_info_list = self._extract_image_info_from_image(image)
+        image_info_list = self._cache_image(image)
+        image_info = next((image_info for image_info in image_info_list if image_info.id_ == image_id), image_info_list[0])
+        self._image_working_dir_cache.set(image_id, self._image_working_dir_cache.get(image_info.id_))
+        return self._image_info_cache.set(image_id, image_info)
+
+    def _cache_image(self, image: Image) -> list[ImageInfo]:
+        assert isinstance(image.attrs, dict), f'Image.attrs is not a dictionary, {type(image.attrs)}'
+        working_dir = image.attrs.get('Config', {}).get('WorkingDir') or ''
 
-        return image_info_list[0]
+        image_info_list = self._extract_image_info_from_image(image)
+        for image_info in image_info_list:
+            self._image_info_cache.set(image_info.id_, image_info)
+            self._image_working_dir_cache.set(image_info.id_, working_dir)
+        return image_info_list
 
     def create_game_server(self, user_id: str, image_id: str) -> ServerInfo:
         image = self.get_image_info(image_id=image_id)
@@ -192,22 +354,23 @@ class DockerRunner(ContainerRunner):
         if image is None:
             raise GameNotFound(f'Game {image_id} was not found')
 
-        existing_servers = self.list_servers(user_id=user_id, image_id=image.id_)
-
-        if len(existing_servers) > 5:
+        if self.count_servers(user_id=user_id, image_id=image.id_) >= MAX_SERVERS_PER_GAME:
             raise MaxServersReached()
 
         volume: Volume = cast(Volume, self.docker.volumes.create(labels=VolumeLabels(user_id=user_id, image_id=image.id_).model_dump(mode='json')))
 
         assert volume.attrs is not None, 'Volume.attrs was None'
 
-        volume_labels = VolumeLabels(**volume.attrs.get('Labels', {}))
-        return ServerInfo(id_=str(volume.id), user_id=volume_labels.user_id, image=image, on=False)
+        volume_labels = VolumeLabels.model_validate(volume.attrs.get('Labels', {}))
+        return ServerInfo.model_construct(id_=str(volume.id), user_id=volume_labels.user_id, image=image, on=False)
 
-    def _get_server_image_working_dir(self, image_id: str):
-        image = self.docker.images.get(image_id)
-        assert image.attrs is not None, 'Image.attrs was None'
-        return image.attrs.get('Config', {}).get('WorkingDir')
+    def _get_server_image_working_dir(self, image_id: str) -> str:
+        working_dir = self._image_working_dir_cache.get(image_id)
+        if working_dir is None:
+            self._image_info_cache.pop(image_id)
+            self.get_image_info(image_id=image_id)
+            working_dir = self._image_working_dir_cache.get(image_id) or ''
+        return working_dir
 
     def start_game_server(self, server_id: str, ports: Optional[dict[Port, Optional[Port]]] = None, command_parameters: Optional[str] = None) -> ServerInfo:
         server_info = self.get_server_info(server_id)
@@ -244,57 +407,64 @@ class DockerRunner(ContainerRunner):
             ),
         )
         container.start()
-        time.sleep(0.01)
-        container = cast(Container, self.docker.containers.get(container_id=container.id))
-
-        return ServerInfo(
+        container.reload()
+        delay = PORTS_POLL_INITIAL_DELAY
+        while ports and not container.ports and delay <= PORTS_POLL_MAX_DELAY:
+            time.sleep(delay)
+            delay *= 2
+            container.reload()
+
+        return ServerInfo.model_construct(
             id_=server_info.id_,
             user_id=server_info.user_id,
             image=server_info.image,
             on=True,
-            ports=self._extract_ports_from_container(container),
+            ports=set(self._extract_ports_from_container(container)),
             domain=self._domain,
         )
 
     def run_command(self, server_id: str, command: str) -> Optional[str]:
         try:
-            container = cast(Container, self.docker.containers.list(filters={'label': create_labels_filter(volume_id=server_id)})[0])
+            container = cast(
+                Container,
+                self.docker.containers.list(filters={'label': create_labels_filter(volume_id=server_id, type=ServerType.GAME.value)}, sparse=True)[0],
+            )
         except Exception as e:
             raise ServerNotRunning(e)
 
         sin = container.attach_socket(params={'stdin': True, 'stream': True, 'stdout': True, 'stderr': True})
+        sock = getattr(sin, '_sock', sin)
 
-        os.write(sin.fileno(), f'{command}\n'.encode('utf-8'))
-        all_output = ''
-        with open(sin.fileno(), 'rb') as f:
-            read, _, _ = select.select([f], [], [], 0.1)
-            retries = 5
-            lines = 20
-            while lines > 0:
-                read, _, _ = select.select([f], [], [], 0.1)
-                if f not in read:
-                    if retries >= 0:
-                        retries -= 1
-                        continue
+        output = bytearray()
+        deadline = time.monotonic() + COMMAND_OUTPUT_DEADLINE
+        try:
+            sock.settimeout(COMMAND_FIRST_OUTPUT_TIMEOUT)
+            sock.sendall(f'{command}\n'.encode('utf-8'))
+            while output.count(b'\n') < COMMAND_OUTPUT_MAX_LINES and time.monotonic() < deadline:
+                try:
+                    chunk = sock.recv(COMMAND_OUTPUT_CHUNK_SIZE)
+                except TimeoutError:
                     break
-
-                r = ANSI_ESCAPE.sub(b'', f.readline()).decode().replace('\r', '')
-                all_output += f'{r}\n'
-                lines -= 1
+                if not chunk:
+                    break
+                output += chunk
+                sock.settimeout(COMMAND_OUTPUT_IDLE_TIMEOUT)
+        finally:
             sin.close()
-            return all_output
+            sock.close()
+
+        lines = _convert_to_string(_strip_ansi(output)).split('\n')
+        return '\n'.join(lines[:COMMAND_OUTPUT_MAX_LINES])
 
     def delete_game_server(self, server_id: str):
+        containers = cast(list[Container], self.docker.containers.list(all=True, filters={'label': f'volume_id={server_id}'}, sparse=True))
+        _for_each_container(containers, lambda container: container.remove(force=True))
+
         try:
-            volume = cast(Volume, self.docker.volumes.get(server_id))
-        except Exception as e:
+            self.docker.api.remove_volume(server_id, force=True)
+        except NotFound as e:
             raise ServerNotFound(e)
 
-        for container in cast(list[Container], self.docker.containers.list(all=True, filters={'label': f'volume_id={server_id}'})):
-            container.remove(force=True)
-
-        volume.remove(force=True)
-
     def start_file_browser(self, server_id: str, owner_id: str, hashed_password=None) -> FileBrowserInfo:
         filebrowser_command = '-r /tmp/data'
 
@@ -307,10 +477,11 @@ class DockerRunner(ContainerRunner):
 
         container = self._get_server_container(server_info=server_info, user_id=owner_id, server_type=ServerType.FILE_BROWSER)
         if container is None:
+            self._ensure_filebrowser_image()
             container = cast(
                 Container,
                 self.docker.containers.create(
-                    image=FILE_BROWSER_IMAGE,
+                    image=self._filebrowser_image,
                     command=filebrowser_command,
                     mounts=mounts,
                     network='browsers',
@@ -322,10 +493,8 @@ class DockerRunner(ContainerRunner):
                 ),
             )
             container.start()
-            time.sleep(0.01)
-            container = cast(Container, self.docker.containers.get(container_id=container.id))
 
-        return FileBrowserInfo(id_=container.id[:12], domain=f'browsers.{self._domain}', connected_to=server_info, owner_id=owner_id)
+        return FileBrowserInfo.model_construct(id_=container.id[:12], domain=self._browsers_domain, connected_to=server_info, owner_id=owner_id)
 
     def stop_file_browsing_by_user_and_server(self, user_id: str, server_id: Optional[str] = None):
         file_browsers = cast(
@@ -334,11 +503,11 @@ class DockerRunner(ContainerRunner):
                 filters={
                     'label': create_labels_filter(user_id=user_id, volume_id=server_id, type=ServerType.FILE_BROWSER.value)
 
-                }
+                },
+                sparse=True,
             ),
         )
-        for file_browser in file_browsers:
-            file_browser.stop()
+        _for_each_container(file_browsers, lambda file_browser: file_browser.stop())
 
     def stop_file_browsing_by_id(self, browser_id: str):
         file_browser = self.get_file_browser_by_id(browser_id=browser_id)
@@ -367,35 +536,37 @@ class DockerRunner(ContainerRunner):
         if lines_limit is None:
             lines_limit = 'all'
 
-        server_info = self.get_server_info(server_id=server_id)
-        container = self._get_server_container(server_info=server_info, server_type=ServerType.GAME)
-
+        _, container = self._get_server_info_and_container(server_id=server_id)
         if container is None:
             raise ServerNotRunning()
 
-        logs = ANSI_ESCAPE.sub(b'', container.logs(tail=lines_limit))
+        logs = _strip_ansi(container.logs(tail=lines_limit))
         return _convert_to_string(logs)
 
     def list_file_browser_servers(self, user_id: Optional[str] = None) -> list[FileBrowserInfo]:
-        containers = cast(list[Container], self.docker.containers.list(filters={'label': create_labels_filter(user_id=user_id, type=ServerType.FILE_BROWSER.value)}))
+        containers = cast(list[Container], self.docker.containers.list(filters={'label': create_labels_filter(user_id=user_id, type=ServerType.FILE_BROWSER.value)}, sparse=True))
+        if not containers:
+            return []
+
+        servers = {server_info.id_: server_info for server_info in self.list_servers()}
         server_info_list: list[FileBrowserInfo] = []
         for container in containers:
             assert isinstance(container.attrs, dict), f'Container.attrs is not dict {type(container.attrs)=}'
 
-            labels = ContainerLabels(**container.attrs.get('Config', {}).get('Labels', {}))
-            server_info = self.get_server_info(server_id=labels.volume_id)
-            server_info_list.append(FileBrowserInfo(id_=container.id[:12], domain=f'browsers.{self._domain}', connected_to=server_info, owner_id=labels.user_id))
+            labels = ContainerLabels.model_validate(container.attrs.get('Labels', {}))
+            server_info = servers.get(labels.volume_id) or self.get_server_info(server_id=labels.volume_id)
+            server_info_list.append(FileBrowserInfo.model_construct(id_=container.id[:12], domain=self._browsers_domain, connected_to=server_info, owner_id=labels.user_id))
 
         return server_info_list
 
     def get_file_browser_by_user_and_server(self, user_id: str, server_id: str) -> Optional[FileBrowserInfo]:
-        containers = cast(list[Container], self.docker.containers.list(filters={'label': create_labels_filter(user_id=user_id, volume_id=server_id, type=ServerType.FILE_BROWSER.value)}))
+        containers = cast(list[Container], self.docker.containers.list(filters={'label': create_labels_filter(user_id=user_id, volume_id=server_id, type=ServerType.FILE_BROWSER.value)}, sparse=True))
         if len(containers) == 0:
             return None
         container = containers[0]
-        labels = ContainerLabels(**container.attrs.get('Config', {}).get('Labels', {}))
+        labels = ContainerLabels.model_validate(container.attrs.get('Labels', {}))
         server_info = self.get_server_info(server_id=labels.volume_id)
-        return FileBrowserInfo(id_=container.id[:12], domain=f'browsers.{self._domain}', connected_to=server_info, owner_id=labels.user_id)
+        return FileBrowserInfo.model_construct(id_=container.id[:12], domain=self._browsers_domain, connected_to=server_info, owner_id=labels.user_id)
 
     def get_file_browser_by_id(self, browser_id: str) -> Optional[FileBrowserInfo]:
         try:
@@ -403,46 +574,41 @@ class DockerRunner(ContainerRunner):
         except Exception as e:
             return None
         
-        labels = ContainerLabels(**container.attrs.get('Config', {}).get('Labels', {}))
+        labels = ContainerLabels.model_validate(container.attrs.get('Config', {}).get('Labels', {}))
         server_info = self.get_server_info(server_id=labels.volume_id)
-        return FileBrowserInfo(id_=container.id[:12], domain=f'browsers.{self._domain}', connected_to=server_info, owner_id=labels.user_id)
+        return FileBrowserInfo.model_construct(id_=container.id[:12], domain=self._browsers_domain, connected_to=server_info, owner_id=labels.user_id)
 
 
     def stop_game_server(self, server_id: str) -> ServerInfo:
-        server_info = self.get_server_info(server_id=server_id)
-        if not server_info.on:
-            raise ServerNotRunning()
-
-        container = self._get_server_container(server_info=server_info, server_type=ServerType.GAME)
+        server_info, container = self._get_server_info_and_container(server_id=server_id)
         if container is None:
             raise ServerNotRunning()
 
         container.stop()
-        return self.get_server_info(server_id=server_id)
+        return ServerInfo.model_construct(id_=server_info.id_, user_id=server_info.user_id, image=server_info.image, on=False)
 
     @staticmethod
     def _extract_image_info_from_image(image: Image) -> list[ImageInfo]:
-        image_info_list: list[ImageInfo] = []
-        tags = image.tags
         assert isinstance(image.attrs, dict), f'Image.attrs is not a dictionary, {type(image.attrs)}'
         exposed_ports = image.attrs.get('Config', {}).get('ExposedPorts', {})
-        ports: list[Port] = []
-        for port, data in exposed_ports.items():
-            port_number, protocol = port.split('/')
-            ports.append(Port(number=port_number, protocol=protocol))
+        ports = frozenset(map(_parse_port, exposed_ports))
 
-        for tag in tags:
-            name, version = tag.split(':')
-            image_info_list.append(ImageInfo(name=name, version=version, ports=set(ports)))
+        image_info_list: list[ImageInfo] = []
+        for tag in image.tags:
+            name, _, version = tag.rpartition(':')
+            image_info_list.append(ImageInfo.model_construct(name=name, version=version, ports=ports))
 
         return image_info_list
 
+    @staticmethod
+    def _extract_ports_from_container_summary(container_summary: dict) -> List[Port]:
+        return [_parse_port(f"{port['PublicPort']}/{port['Type']}") for port in container_summary.get('Ports') or () if port.get('PublicPort')]
+
     @staticmethod
     def _extract_ports_from_container(container: Container) -> List[Port]:
         available_ports: list[Port] = []
         for key, value in container.ports.items():
             protocol = key.split('/')[-1]
             if value:
-                host_ports = [v['HostPort'] for v in value]
-                available_ports.extend(Port(number=port, protocol=protocol) for port in host_ports)
+                available_ports.extend(_parse_port(f"{v['HostPort']}/{protocol}") for v in value)
         return available_ports
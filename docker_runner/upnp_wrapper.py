@@ -1,25 +1,279 @@
+import json
+import re
+import select
 import socket
 import logging
-from typing import Optional, List, Union
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Callable, Iterable, List, NamedTuple, Optional, TypeVar, Union
+import requests
 import upnpclient
+from requests.adapters import HTTPAdapter
+from lxml import etree
+from upnpclient.marshal import marshal_value
+from upnpclient.soap import ENCODING, ENCODING_STYLE, NS_SOAP_ENV, NS_UPNP_ERR, SOAP_TIMEOUT, SOAPError, SOAPProtocolError
 
 from docker_runner.container_runner.container_runner_interface import ContainerRunner, ImageInfo, Port, ServerInfo, ServerType
 from enum import Enum
 
 
+DISCOVERY_CACHE_TTL = 600
+DISCOVERY_TIMEOUT = 2
+MAX_CONCURRENT_PORT_MAPPINGS = 8
+PORT_MAPPING_LEASE_DURATION = 600
+PORT_MAPPING_RENEWAL_INTERVAL = 400
+SSDP_ADDRESS = ('239.255.255.250', 1900)
+GATEWAY_SEARCH_TARGETS = ('urn:schemas-upnp-org:device:InternetGatewayDevice:1', 'urn:schemas-upnp-org:device:InternetGatewayDevice:2')
+SSDP_LOCATION = re.compile(r'^LOCATION: *(\S+)', re.IGNORECASE | re.MULTILINE)
+UPNP_DEVICES_PATH = Path(__file__).resolve().parent.parent / '.upnp_devices'
+
+_DEVICE_CACHE: dict[str, tuple[float, list[upnpclient.Device]]] = {}
+_DEVICE_CACHE_LOCK = threading.Lock()
+_DEVICE_REFRESHES: set[str] = set()
+
+T = TypeVar('T')
+
+
 class Protocol(str, Enum):
     TCP = 'TCP'
     UDP = 'UDP'
 
 
+class PortMapping(NamedTuple):
+    location: str
+    protocol: Protocol
+    local_port: int
+    remote_addr: str
+    external_port: int
+    leased: bool
+
+    @property
+    def key(self) -> tuple[str, Protocol, int]:
+        return self.location, self.protocol, self.local_port
+
+
+def _soap_call(session: requests.Session, action: upnpclient.Action, arguments: dict) -> dict:
+    soap_env = f'{{{NS_SOAP_ENV}}}'
+    root = etree.Element(soap_env + 'Envelope', nsmap={'SOAP-ENV': NS_SOAP_ENV})
+    root.attrib[soap_env + 'encodingStyle'] = ENCODING_STYLE
+    request = etree.SubElement(etree.SubElement(root, soap_env + 'Body'), f'{{{action.service_type}}}{action.name}', nsmap={'m': action.service_type})
+    for key, value in arguments.items():
+        etree.SubElement(request, key).text = str(value)
+
+    device = action.service.device
+    headers = {'SOAPAction': f'"{action.service_type}#{action.name}"', 'Content-Type': 'text/xml', **(device.http_headers or {})}
+    response = session.post(action.url, etree.tostring(root, encoding=ENCODING, xml_declaration=True), headers=headers, timeout=SOAP_TIMEOUT, auth=device.http_auth)
+    if not response.ok:
+        try:
+            upnp_error = etree.fromstring(response.content).find(f'.//{{{NS_UPNP_ERR}}}UPnPError')
+        except etree.XMLSyntaxError:
+            upnp_error = None
+        if upnp_error is None:
+            response.raise_for_status()
+        raise SOAPError(int(upnp_error.findtext(f'{{{NS_UPNP_ERR}}}errorCode')), upnp_error.findtext(f'{{{NS_UPNP_ERR}}}errorDescription'))
+
+    xml_str = response.content.strip()
+    try:
+        xml = etree.fromstring(xml_str)
+    except etree.XMLSyntaxError:
+        # Some devices repeat the XML declaration inside the body
+        xml = etree.fromstring(re.sub(rb'<\?xml.*?\?>', b'', xml_str, flags=re.IGNORECASE))
+
+    result = xml.find(f'.//{{{action.service_type}}}{action.name}Response')
+    if result is None:
+        raise SOAPProtocolError(f'Returned XML did not include a {action.name}Response element')
+    # Arguments holding unescaped XML are parsed as child elements, turn them back into text
+    return {argument.tag: b'\n'.join(map(etree.tostring, argument)) if len(argument) else argument.text for argument in result}
+
+
+def _call_action(action: upnpclient.Action, session: requests.Session, **kwargs) -> dict:
+    arguments = {}
+    for name, state_variable in action.argsdef_in:
+        if name not in kwargs:
+            raise upnpclient.UPNPError(f"Missing required param '{name}'")
+        valid, reasons = action.validate_arg(kwargs[name], state_variable)
+        if not valid:
+            raise upnpclient.ValidationError({name: reasons})
+        arguments[name] = kwargs[name]
+
+    response = _soap_call(session, action, arguments)
+    return {name: marshal_value(state_variable['datatype'], response[name])[1] for name, state_variable in action.argsdef_out}
+
+
+def _run_concurrently(operations: list[Callable[[], T]]) -> list[T]:
+    if len(operations) <= 1:
+        return [operation() for operation in operations]
+
+    with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_PORT_MAPPINGS, len(operations))) as executor:
+        return [future.result() for future in [executor.submit(operation) for operation in operations]]
+
+
+def _search_gateway_locations(local_addr: str, timeout: float) -> set[str]:
+    locations: set[str] = set()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+        sock.bind((local_addr, 0))
+        for search_target in GATEWAY_SEARCH_TARGETS:
+            sock.sendto(
+                f'M-SEARCH * HTTP/1.1\r\nHOST: {SSDP_ADDRESS[0]}:{SSDP_ADDRESS[1]}\r\nMAN: "ssdp:discover"\r\nMX: {max(1, int(timeout))}\r\nST: {search_target}\r\n\r\n'.encode(),
+                SSDP_ADDRESS,
+            )
+
+        wait = timeout
+        while select.select([sock], [], [], wait)[0]:
+            response = sock.recv(2048).decode('utf-8', errors='replace')
+            locations.update(SSDP_LOCATION.findall(response))
+            if locations:
+                wait = 0
+    except OSError as e:
+        logging.error(f'SSDP gateway search failed, {e}')
+    finally:
+        sock.close()
+    return locations
+
+
+def _discover_devices(local_addr: str, timeout: float) -> list[upnpclient.Device]:
+    devices = []
+    for location in _search_gateway_locations(local_addr=local_addr, timeout=timeout):
+        try:
+            devices.append(upnpclient.Device(location))
+        except Exception as e:
+            logging.error(f'Failed to load UPnP device at {location}, {e}')
+
+    if not devices:
+        devices = upnpclient.discover(timeout=timeout)
+    return [device for device in devices if 'AddPortMapping' in (action.name for action in device.actions)]
+
+
+def _load_saved_devices(local_addr: str) -> list[upnpclient.Device]:
+    try:
+        locations = json.loads(UPNP_DEVICES_PATH.read_text()).get(local_addr, [])
+    except (OSError, ValueError):
+        return []
+
+    try:
+        return [upnpclient.Device(location) for location in locations]
+    except Exception as e:
+        logging.info(f'Saved UPnP devices are unreachable, rediscovering, {e}')
+        return []
+
+
+def _save_devices(local_addr: str, devices: list[upnpclient.Device]):
+    try:
+        saved_locations = json.loads(UPNP_DEVICES_PATH.read_text()) if UPNP_DEVICES_PATH.exists() else {}
+        saved_locations[local_addr] = [device.location for device in devices]
+        UPNP_DEVICES_PATH.write_text(json.dumps(saved_locations))
+    except (OSError, ValueError) as e:
+        logging.error(f'Failed to save UPnP devices, {e}')
+
+
+def _find_actions(devices: list[upnpclient.Device], *action_names: str) -> list[upnpclient.Action]:
+    actions = []
+    for device in devices:
+        action = next((action for action in map(device.find_action, action_names) if action is not None), None)
+        if action is None:
+            logging.error(f'Device {device} has no action "{action_names[-1]}"')
+            continue
+        actions.append(action)
+    return actions
+
+
+def _refresh_devices(local_addr: str, timeout: float, use_saved: bool = False) -> list[upnpclient.Device]:
+    try:
+        devices = _load_saved_devices(local_addr=local_addr) if use_saved else []
+        if not devices:
+            devices = _discover_devices(local_addr=local_addr, timeout=timeout)
+            if devices:
+                _save_devices(local_addr=local_addr, devices=devices)
+        with _DEVICE_CACHE_LOCK:
+            _DEVICE_CACHE[local_addr] = (time.monotonic(), devices)
+        return devices
+    finally:
+        with _DEVICE_CACHE_LOCK:
+            _DEVICE_REFRESHES.discard(local_addr)
+
+
+def _get_cached_devices(local_addr: str, timeout: float = DISCOVERY_TIMEOUT, force_refresh: bool = False) -> list[upnpclient.Device]:
+    with _DEVICE_CACHE_LOCK:
+        cached = _DEVICE_CACHE.get(local_addr)
+        if cached is not None and not force_refresh:
+            discovered_at, devices = cached
+            if time.monotonic() - discovered_at >= DISCOVERY_CACHE_TTL and local_addr not in _DEVICE_REFRESHES:
+                _DEVICE_REFRESHES.add(local_addr)
+                threading.Thread(target=_refresh_devices, args=(local_addr, timeout), daemon=True).start()
+            return devices
+        _DEVICE_REFRESHES.add(local_addr)
+
+    return _refresh_devices(local_addr=local_addr, timeout=timeout, use_saved=cached is None)
+
+
 class UpnpClient:
-    def __init__(self, device_locations: Optional[list[str]] = None):
+    def __init__(self, device_locations: Optional[list[str]] = None, container_runner: Optional[ContainerRunner] = None):
+        self._local_addr = self._get_ip()
+        self._container_runner = container_runner
+        self._port_mappings: dict[Optional[str], dict[tuple[str, Protocol, int], PortMapping]] = {}
+        self._port_mappings_lock = threading.Lock()
+        # The connection pool behind the adapter is thread safe and keeps a connection per concurrent call to each gateway
+        self._session = requests.Session()
+        self._session.mount('http://', HTTPAdapter(pool_maxsize=MAX_CONCURRENT_PORT_MAPPINGS))
+        self._renewal_timer: Optional[threading.Timer] = None
+        self._device_locations = device_locations
+        self._devices_lock = threading.Lock()
         if device_locations:
-            self._devices = [upnpclient.Device(location) for location in device_locations]
+            self.refresh_devices()
         else:
-            self._devices = [device for device in upnpclient.discover() if 'AddPortMapping' in (action.name for action in device.actions)]
-            
-        self._local_addr = self._get_ip()
+            self._set_devices(_get_cached_devices(local_addr=self._local_addr))
+        if container_runner is not None:
+            threading.Thread(target=self._restore_port_mappings, name='upnp-restore-port-mappings', daemon=True).start()
+
+    def _restore_port_mappings(self):
+        # Leases only live in this process, so servers left running by a previous process need theirs taken again
+        try:
+            servers = self._container_runner.list_servers()
+        except Exception as e:
+            logging.error(f'Failed to list servers to restore port mappings, {e}', exc_info=True)
+            return
+
+        for server_info in servers:
+            if server_info.on:
+                self.add_port_mapping_using_server_info(server_info)
+
+    def refresh_devices(self):
+        if self._device_locations:
+            self._set_devices([upnpclient.Device(location) for location in self._device_locations])
+        else:
+            self._set_devices(_get_cached_devices(local_addr=self._local_addr, force_refresh=True))
+
+    def _sync_devices(self):
+        # Picks up gateways rediscovered in the background once the shared cache entry passes DISCOVERY_CACHE_TTL
+        if self._device_locations:
+            return
+        devices = _get_cached_devices(local_addr=self._local_addr)
+        if devices is not self._devices:
+            self._set_devices(devices)
+
+    def _refresh_devices_after_failure(self, failed_since: float):
+        with self._devices_lock:
+            # Concurrent failures share a single rediscovery
+            if self._devices_refreshed_at >= failed_since:
+                return
+            try:
+                self.refresh_devices()
+            except Exception as e:
+                logging.error(f'Failed to rediscover UPnP devices, {e}', exc_info=True)
+
+    def _set_devices(self, devices: list[upnpclient.Device]):
+        self._devices = devices
+        self._devices_refreshed_at = time.monotonic()
+        self._add_port_mapping_actions = {action.service.device.location: action for action in _find_actions(devices, 'AddAnyPortMapping', 'AddPortMapping')}
+        self._delete_port_mapping_actions = {action.service.device.location: action for action in _find_actions(devices, 'DeletePortMapping')}
+
+    def _call(self, action: upnpclient.Action, **kwargs) -> dict:
+        return _call_action(action, self._session, **kwargs)
 
     @classmethod
     def _get_ip(cls):
@@ -35,42 +289,174 @@ class UpnpClient:
             s.close()
         return IP
 
-    def add_port_mapping_using_server_info(self, server_info: ServerInfo):
-        
+    def add_port_mapping_using_server_info(self, server_info: ServerInfo) -> ServerInfo:
         if server_info.ports is None:
             return server_info
 
-        for port in server_info.ports:
-            self.add_port_mapping(local_port=port.number, remote_port=port.number, protocol=Protocol(port.protocol.upper()))
-        return server_info
+        self._sync_devices()
+        port_mappings = self._open_ports([
+            (location, Protocol(port.protocol.upper()), port.number, '', None)
+            for port in server_info.ports
+            for location in self._add_port_mapping_actions
+        ])
+        self._track_port_mappings(server_info.id_, port_mappings)
 
+        if not port_mappings:
+            return server_info
 
-    def add_port_mapping(self, protocol: Protocol, local_port: int, remote_addr: str = '', remote_port: Optional[int] = None):
-        for device in self._devices:
-            try:
-                action = device.find_action('AddPortMapping')
-                if action is None:
-                    logging.error(f'Device {device} has no action "AddPortMapping"')
-                    continue
-                
-                action(
-                    NewEnabled='1',
-                    NewInternalClient=self._local_addr,
-                    NewInternalPort=local_port,
-                    NewExternalPort=remote_port if remote_port is not None else local_port,
-                    NewRemoteHost=remote_addr,
-                    NewLeaseDuration=0,
-                    NewPortMappingDescription=f'{self._local_addr}:{local_port} to {remote_addr}:{remote_port} {protocol}',
-                    NewProtocol=Protocol(protocol).value,
-                )
-            except Exception as e:
-                print(f'Faield to open {remote_addr}:{remote_port}->{self._local_addr}:{local_port} {protocol}, {e}')
+        # Ports that failed to map keep their original number, mapped ones report what the gateway reserved
+        mapped_ports = {(port_mapping.protocol.lower(), port_mapping.local_port) for port_mapping in port_mappings}
+        ports = {port for port in server_info.ports if (port.protocol.value, port.number) not in mapped_ports}
+        ports.update(Port(number=port_mapping.external_port, protocol=port_mapping.protocol.lower()) for port_mapping in port_mappings)
+        return server_info.model_copy(update={'ports': ports})
+
+    def add_port_mapping(self, protocol: Protocol, local_port: int, remote_addr: str = '', remote_port: Optional[int] = None, server_id: Optional[str] = None) -> list[int]:
+        self._sync_devices()
+        port_mappings = self._open_ports([(location, protocol, local_port, remote_addr, remote_port) for location in self._add_port_mapping_actions])
+        self._track_port_mappings(server_id, port_mappings)
+        return [port_mapping.external_port for port_mapping in port_mappings]
+
+    def remove_port_mappings(self, server_id: Optional[str]):
+        with self._port_mappings_lock:
+            port_mappings = self._port_mappings.pop(server_id, {})
+            if self._renewal_timer is not None and not self._has_leased_mappings():
+                self._renewal_timer.cancel()
+                self._renewal_timer = None
+
+        _run_concurrently([partial(self._delete_device_port_mapping, port_mapping) for port_mapping in port_mappings.values()])
+
+    def _open_ports(self, port_requests: list[tuple[str, Protocol, int, str, Optional[int]]]) -> list[PortMapping]:
+        started_at = time.monotonic()
+        results = _run_concurrently([partial(self._add_device_port_mapping, *request) for request in port_requests])
+        failed = [request for request, result in zip(port_requests, results) if result is None]
+        port_mappings = [result for result in results if result is not None]
+        if not failed:
+            return port_mappings
+
+        # The gateway may have rebooted onto a new control URL, rediscover it and retry what failed
+        if any(location in self._add_port_mapping_actions for location, *_ in failed):
+            self._refresh_devices_after_failure(started_at)
+        current_locations = self._add_port_mapping_actions
+        moved_ports = {tuple(port) for location, *port in failed if location not in current_locations}
+        retries = [request for request in failed if request[0] in current_locations] + [
+            (location, *port) for port in moved_ports for location in current_locations if (location, *port) not in port_requests
+        ]
+        return port_mappings + [result for result in _run_concurrently([partial(self._add_device_port_mapping, *request) for request in retries]) if result is not None]
+
+    def _add_device_port_mapping(
+        self, location: str, protocol: Protocol, local_port: int, remote_addr: str = '', remote_port: Optional[int] = None,
+    ) -> Optional[PortMapping]:
+        action = self._add_port_mapping_actions.get(location)
+        if action is None:
+            return None
+        leased = action.name == 'AddAnyPortMapping'
+        external_port = remote_port if remote_port is not None else local_port
+        try:
+            result = self._call(
+                action,
+                NewEnabled='1',
+                NewInternalClient=self._local_addr,
+                NewInternalPort=local_port,
+                NewExternalPort=external_port,
+                NewRemoteHost=remote_addr,
+                NewLeaseDuration=PORT_MAPPING_LEASE_DURATION if leased else 0,
+                NewPortMappingDescription=f'{self._local_addr}:{local_port} to {remote_addr}:{remote_port} {protocol}',
+                NewProtocol=Protocol(protocol).value,
+            )
+        except Exception as e:
+            logging.error(f'Failed to open {remote_addr}:{remote_port}->{self._local_addr}:{local_port} {protocol}, {e}', exc_info=True)
+            return None
+
+        reserved_port = result.get('NewReservedPort')
+        if leased and reserved_port is not None and int(reserved_port) != external_port:
+            logging.warning(f'Gateway reserved external port {reserved_port} instead of {external_port} for {self._local_addr}:{local_port} {protocol}')
+            external_port = int(reserved_port)
+
+        return PortMapping(location=location, protocol=Protocol(protocol), local_port=local_port, remote_addr=remote_addr, external_port=external_port, leased=leased)
+
+    def _delete_device_port_mapping(self, port_mapping: PortMapping):
+        action = self._delete_port_mapping_actions.get(port_mapping.location)
+        if action is None:
+            return
+
+        try:
+            self._call(action, NewExternalPort=port_mapping.external_port, NewRemoteHost=port_mapping.remote_addr, NewProtocol=port_mapping.protocol.value)
+        except Exception as e:
+            logging.error(f'Failed to close {port_mapping.remote_addr}:{port_mapping.external_port} {port_mapping.protocol}, {e}', exc_info=True)
+
+    def _track_port_mappings(self, server_id: Optional[str], port_mappings: list[PortMapping]):
+        with self._port_mappings_lock:
+            server_mappings = self._port_mappings.setdefault(server_id, {})
+            for port_mapping in port_mappings:
+                server_mappings[port_mapping.key] = port_mapping
+            if self._renewal_timer is None and self._has_leased_mappings():
+                self._schedule_renewal()
+
+    def _has_leased_mappings(self) -> bool:
+        return any(port_mapping.leased for server_mappings in self._port_mappings.values() for port_mapping in server_mappings.values())
+
+    def _schedule_renewal(self):
+        self._renewal_timer = threading.Timer(PORT_MAPPING_RENEWAL_INTERVAL, self._renew_leased_mappings)
+        self._renewal_timer.daemon = True
+        self._renewal_timer.start()
+
+    def _renew_leased_mappings(self):
+        with self._port_mappings_lock:
+            leased_mappings = {
+                server_id: [port_mapping for port_mapping in server_mappings.values() if port_mapping.leased]
+                for server_id, server_mappings in self._port_mappings.items()
+            }
+            self._renewal_timer = None
+            if any(leased_mappings.values()):
+                self._schedule_renewal()
+
+        # Another process may have stopped the server, so only keep leasing ports of servers that are still running
+        stopped_server_ids = self._stopped_server_ids(server_id for server_id in leased_mappings if server_id is not None)
+        for server_id in stopped_server_ids:
+            self.remove_port_mappings(server_id)
+
+        self._sync_devices()
+        for server_id, port_mappings in leased_mappings.items():
+            if port_mappings and server_id not in stopped_server_ids:
+                self._renew_server_mappings(server_id, port_mappings)
+
+    def _stopped_server_ids(self, server_ids: Iterable[str]) -> set[str]:
+        if self._container_runner is None:
+            return set()
+
+        try:
+            running_server_ids = {server_info.id_ for server_info in self._container_runner.list_servers() if server_info.on}
+        except Exception as e:
+            logging.error(f'Failed to list servers before renewing port mappings, {e}', exc_info=True)
+            return set()
+        return {server_id for server_id in server_ids if server_id not in running_server_ids}
+
+    def _renew_server_mappings(self, server_id: Optional[str], port_mappings: list[PortMapping]):
+        renewed_mappings = self._open_ports([
+            (port_mapping.location, port_mapping.protocol, port_mapping.local_port, port_mapping.remote_addr, port_mapping.external_port)
+            for port_mapping in port_mappings
+        ])
+
+        with self._port_mappings_lock:
+            server_mappings = self._port_mappings.get(server_id)
+            if server_mappings is not None:
+                for port_mapping in port_mappings:
+                    if port_mapping.location not in self._add_port_mapping_actions:
+                        server_mappings.pop(port_mapping.key, None)
+                for port_mapping in renewed_mappings:
+                    server_mappings[port_mapping.key] = port_mapping
+
+        # The server was stopped while its leases were being renewed, so take the mappings down again.
+        if server_mappings is None:
+            _run_concurrently([partial(self._delete_device_port_mapping, port_mapping) for port_mapping in renewed_mappings])
 
 class UPNPWrapper(ContainerRunner):
     def __init__(self, container_runner: ContainerRunner):
-        self._devices = [device for device in upnpclient.discover(timeout=0.1) if 'AddPortMapping' in (action.name for action in device.actions)]
         self._container_runner = container_runner
         self._local_addr = self._get_ip()
+        self._devices = _get_cached_devices(local_addr=self._local_addr)
+        self._add_port_mapping_actions = _find_actions(self._devices, 'AddPortMapping')
+        self._delete_port_mapping_actions = _find_actions(self._devices, 'DeletePortMapping')
         print(f'Local IP Address: {self._local_addr}')
 
     @staticmethod
@@ -80,34 +466,49 @@ class UPNPWrapper(ContainerRunner):
             if server_info.ports is None:
                 return server_info
 
-            for port in server_info.ports:
-                self._add_port_mapping(local_addr=self._local_addr, local_port=port.number, remote_port=port.number, protocol=port.protocol.upper())
+            _run_concurrently([
+                partial(self._add_device_port_mapping, action, local_addr=self._local_addr, local_port=port.number, remote_port=port.number, protocol=port.protocol.upper())
+                for port in server_info.ports
+                for action in self._add_port_mapping_actions
+            ])
             return server_info
 
         return inner
 
     def _add_port_mapping(self, protocol: Protocol, local_addr: str, local_port: int, remote_addr: str = '', remote_port: Optional[int] = None):
-        for device in self._devices:
-            try:
-                device.find_action('AddPortMapping')(
-                    NewEnabled='1',
-                    NewInternalClient=local_addr,
-                    NewInternalPort=local_port,
-                    NewExternalPort=remote_port if remote_port is not None else local_port,
-                    NewRemoteHost=remote_addr,
-                    NewLeaseDuration=0,
-                    NewPortMappingDescription=f'{local_addr}:{local_port} to {remote_addr}:{remote_port} {protocol}',
-                    NewProtocol=protocol,
-                )
-            except Exception as e:
-                print(f'Faield to open {remote_addr}:{remote_port}->{local_addr}:{local_port} {protocol}, {e}')
+        _run_concurrently([
+            partial(self._add_device_port_mapping, action, protocol=protocol, local_addr=local_addr, local_port=local_port, remote_addr=remote_addr, remote_port=remote_port)
+            for action in self._add_port_mapping_actions
+        ])
+
+    def _add_device_port_mapping(
+        self, action: upnpclient.Action, protocol: Protocol, local_addr: str, local_port: int, remote_addr: str = '', remote_port: Optional[int] = None,
+    ):
+        try:
+            action(
+                NewEnabled='1',
+                NewInternalClient=local_addr,
+                NewInternalPort=local_port,
+                NewExternalPort=remote_port if remote_port is not None else local_port,
+                NewRemoteHost=remote_addr,
+                NewLeaseDuration=0,
+                NewPortMappingDescription=f'{local_addr}:{local_port} to {remote_addr}:{remote_port} {protocol}',
+                NewProtocol=protocol,
+            )
+        except Exception as e:
+            logging.error(f'Failed to open {remote_addr}:{remote_port}->{local_addr}:{local_port} {protocol}, {e}', exc_info=True)
 
     def _remove_port_mapping(self, protocol: Protocol, remote_port: int, remote_addr: str = ''):
-        for device in self._devices:
-            try:
-                device.find_action('DeletePortMapping')(NewExternalPort=remote_port, NewRemoteHost=remote_addr, NewProtocol=protocol)
-            except Exception as e:
-                logging.error(f'Faield to closed {remote_addr}:{remote_port} {protocol}, {e}', exc_info=True)
+        _run_concurrently([
+            partial(self._remove_device_port_mapping, action, protocol=protocol, remote_port=remote_port, remote_addr=remote_addr)
+            for action in self._delete_port_mapping_actions
+        ])
+
+    def _remove_device_port_mapping(self, action: upnpclient.Action, protocol: Protocol, remote_port: int, remote_addr: str = ''):
+        try:
+            action(NewExternalPort=remote_port, NewRemoteHost=remote_addr, NewProtocol=protocol)
+        except Exception as e:
+            logging.error(f'Failed to close {remote_addr}:{remote_port} {protocol}, {e}', exc_info=True)
 
     def get_image_info(self, image_id: str) -> ImageInfo:
         return self.get_image_info(image_id=image_id)
@@ -3,6 +3,7 @@ from datetime import datetime, timedelta
 from functools import wraps
 import json
 import logging
+import threading
 from typing_extensions import Annotated
 from uuid import uuid4
 from aiohttp import content_disposition_filename
@@ -13,8 +14,9 @@ from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 from api_code.database import models
-from api_code.database.crud import change_permissions, change_server_nickname, create_token, create_user, create_user_from_token, delete_user, get_all_server_nicknames, get_server_permissions_for_user, get_user, get_users as get_all_users, set_server_permissions_for_user
+from api_code.database.crud import change_permissions, change_server_nickname, create_token, create_user, create_user_from_token, delete_user, get_all_server_nicknames, get_server_permissions_for_user, get_user, iter_users, set_server_permissions_for_user
 from api_code.database.database import engine, SessionLocal
+from api_code.database.migrations import migrate
 from docker_runner.docker_runner import DockerRunner
 from docker_runner.container_runner.container_runner_interface import FileBrowserInfo, ServerInfo, Port, ImageInfo
 from jose import JWTError, jwt
@@ -23,7 +25,7 @@ from passlib.context import CryptContext
 from docker_runner.upnp_wrapper import UpnpClient
 from mail import MailClient
 
-models.Base.metadata.create_all(bind=engine)
+migrate(engine)
 
 class MailConfig(BaseModel):
     username: str
@@ -64,6 +66,11 @@ ALGORITHM = CONFIG.backend.algorithm
 
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+DOCKER_RUNNER: Optional[DockerRunner] = None
+DOCKER_RUNNER_LOCK = threading.Lock()
+UPNP_CLIENT: Optional[UpnpClient] = None
+UPNP_CLIENT_LOCK = threading.Lock()
+
 app = FastAPI()
 
 origins = ["*"]
@@ -121,6 +128,22 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 
+def get_docker_runner() -> DockerRunner:
+    global DOCKER_RUNNER
+    with DOCKER_RUNNER_LOCK:
+        if DOCKER_RUNNER is None:
+            DOCKER_RUNNER = DockerRunner(watch_image_events=True)
+        return DOCKER_RUNNER
+
+
+def get_upnp_client() -> UpnpClient:
+    global UPNP_CLIENT
+    with UPNP_CLIENT_LOCK:
+        if UPNP_CLIENT is None:
+            UPNP_CLIENT = UpnpClient(container_runner=get_docker_runner())
+        return UPNP_CLIENT
+
+
 # Dependency
 @contextmanager
 def get_db():
@@ -156,7 +179,7 @@ def user_data(db_context: Annotated[Session, Depends(get_db)], token: Annotated[
 
 
 @app.post("/token", response_model=Token)
-async def login_for_access_token(
+def login_for_access_token(
     form_data: PasswordRequestForm,
 ):
     user = authenticate_user(get_db(), form_data.username, form_data.password)
@@ -193,7 +216,7 @@ def user_with_permissions(*permissions):
             )
         
 
-        server_info = DockerRunner().get_server_info(server_id=server_id)
+        server_info = get_docker_runner().get_server_info(server_id=server_id)
 
         if server_info.user_id == user.username:    
             return user
@@ -223,7 +246,7 @@ def user_with_permissions(*permissions):
 @app.get('/users')
 def get_users(user: Annotated[models.User, Depends(user_data)]) -> list[models.UserBase]:
     with get_db() as db:
-        return cast(list[models.UserBase], get_all_users(db))
+        return cast(list[models.UserBase], list(iter_users(db)))
 
 
 class InviteUserRequests(BaseModel):
@@ -278,7 +301,7 @@ def change_user_data(user: Annotated[models.User, Depends(user_with_permissions(
 
 @app.get('/servers')
 def get_servers(user: Annotated[models.User, Depends(user_data)]) -> list[ServerInfo]:
-    docker_runner = DockerRunner()
+    docker_runner = get_docker_runner()
     servers = docker_runner.list_servers()
     with get_db() as db:
         nicknames = get_all_server_nicknames(db)
@@ -290,12 +313,12 @@ def get_servers(user: Annotated[models.User, Depends(user_data)]) -> list[Server
 
 @app.get('/images')
 def get_images(user: Annotated[models.User, Depends(user_data)]) -> list[ImageInfo]:
-    docker_runner = DockerRunner()
+    docker_runner = get_docker_runner()
     return docker_runner.list_images()
 
 @app.get('/servers/{server_id}', include_in_schema=False)
 def get_server(user: Annotated[models.User, Depends(user_data)], server_id: str) -> ServerInfo:
-    docker_runner = DockerRunner()
+    docker_runner = get_docker_runner()
     return docker_runner.get_server_info(server_id=server_id)
 
 
@@ -309,16 +332,17 @@ class StartServerRequest(BaseModel):
 
 @app.post('/servers/{server_id}/start', summary='Start', openapi_extra=OpenApiExtra(api_response='Ignore', permissions=[models.Permission.START]).model_dump(mode='json'))
 def start_server(user: Annotated[models.User, Depends(user_with_permissions(models.Permission.START))], server_id: str, request: StartServerRequest) -> ServerInfo:
-    docker_runner = DockerRunner()
+    docker_runner = get_docker_runner()
     server_info = docker_runner.start_game_server(server_id=server_id, ports={mapping.source_port: mapping.destination_port for mapping in request.ports} if len(request.ports) > 0 else None, command_parameters=request.command,)
-    UpnpClient().add_port_mapping_using_server_info(server_info=server_info)
-    return server_info
+    return get_upnp_client().add_port_mapping_using_server_info(server_info=server_info)
 
 
 @app.post('/servers/{server_id}/stop', summary='Stop', openapi_extra=OpenApiExtra(api_response='Ignore', permissions=[models.Permission.STOP]).model_dump(mode='json'))
 def stop_server(user: Annotated[models.User, Depends(user_with_permissions(models.Permission.STOP))], server_id: str) -> ServerInfo:
-    docker_runner = DockerRunner()
-    return docker_runner.stop_game_server(server_id=server_id)
+    docker_runner = get_docker_runner()
+    server_info = docker_runner.stop_game_server(server_id=server_id)
+    get_upnp_client().remove_port_mappings(server_id=server_info.id_)
+    return server_info
 
 
 class CreateServer(BaseModel):
@@ -327,8 +351,8 @@ class CreateServer(BaseModel):
 
 @app.post('/servers', openapi_extra=OpenApiExtra(api_response='Ignore', permissions=[models.Permission.CREATE]).model_dump(mode='json'))
 def create_server(user: Annotated[models.User, Depends(user_with_permissions(models.Permission.CREATE))], request: CreateServer) -> ServerInfo:
-    docker_runner = DockerRunner()
-    if not models.Permission.ADMIN in user.permissions and user.max_owned_servers < len(docker_runner.list_servers(user_id=user.username)):
+    docker_runner = get_docker_runner()
+    if not models.Permission.ADMIN in user.permissions and user.max_owned_servers <= docker_runner.count_servers(user_id=user.username):
         raise HTTPException(401, 'Unauthorized, Max servers count reached')
         
     return docker_runner.create_game_server(image_id=request.image_id, user_id=user.username)
@@ -336,8 +360,9 @@ def create_server(user: Annotated[models.User, Depends(user_with_permissions(mod
 
 @app.delete('/servers/{server_id}', openapi_extra=OpenApiExtra(api_response='Ignore', permissions=[models.Permission.DELETE]).model_dump(mode='json'))
 def delete_server(user: Annotated[models.User, Depends(user_with_permissions(models.Permission.DELETE))], server_id: str) -> None:
-    docker_runner = DockerRunner()
-    return docker_runner.delete_game_server(server_id=server_id)
+    docker_runner = get_docker_runner()
+    docker_runner.delete_game_server(server_id=server_id)
+    get_upnp_client().remove_port_mappings(server_id=server_id)
 
 
 class RunCommandRequest(BaseModel):
@@ -345,7 +370,7 @@ class RunCommandRequest(BaseModel):
 
 @app.post('/servers/{server_id}/command', openapi_extra=OpenApiExtra(api_response='Ignore', permissions=[models.Permission.RUN_COMMAND]).model_dump(mode='json'))
 def run_command(user: Annotated[models.User, Depends(user_with_permissions(models.Permission.RUN_COMMAND))], server_id: str, request: RunCommandRequest) -> str:
-    docker_runner = DockerRunner()
+    docker_runner = get_docker_runner()
     response = docker_runner.run_command(server_id=server_id, command=request.command)
     if response is None:
         raise Exception()  # TODO: change to HTTP exception
@@ -354,7 +379,7 @@ def run_command(user: Annotated[models.User, Depends(user_with_permissions(model
 
 @app.get('/servers/{server_id}/logs', include_in_schema=False)
 def get_server_logs(user: Annotated[models.User, Depends(user_data)], server_id: str) -> str:
-    docker_runner = DockerRunner()
+    docker_runner = get_docker_runner()
     response = docker_runner.get_server_logs(server_id=server_id)
 
     if response is None:
@@ -365,7 +390,7 @@ def get_server_logs(user: Annotated[models.User, Depends(user_data)], server_id:
 
 @app.post('/servers/{server_id}/browse', summary='Browse', openapi_extra=OpenApiExtra(api_response='Browse', permissions=[models.Permission.BROWSE]).model_dump(mode='json'))
 def start_file_browser_from_server(user: Annotated[models.User, Depends(user_with_permissions(models.Permission.BROWSE))], server_id: str) -> str:
-    docker_runner = DockerRunner()
+    docker_runner = get_docker_runner()
     file_browser_server_info = docker_runner.start_file_browser(server_id=server_id, owner_id=user.username, hashed_password=user.password_hash)
     return file_browser_server_info.url
 
@@ -376,7 +401,7 @@ class StartFileBrowserRequest(BaseModel):
 
 @app.get('/browsers')
 def get_file_browsers(user: Annotated[models.User, Depends(user_data)]) -> list[FileBrowserInfo]:
-    docker_runner = DockerRunner()
+    docker_runner = get_docker_runner()
     responses: list[FileBrowserInfo] = []
     with get_db() as db:
         nicknames = get_all_server_nicknames(db)
@@ -417,7 +442,7 @@ def browser_owner_server_owner_or_permissions(*permissions: models.Permission):
                 detail='Unauthorized'
             )
         
-        docker_runner = DockerRunner()
+        docker_runner = get_docker_runner()
         file_browser = docker_runner.get_file_browser_by_id(browser_id=browser_id)
         
         if file_browser is None:
@@ -444,7 +469,7 @@ def browser_owner_server_owner_or_permissions(*permissions: models.Permission):
 
 @app.delete('/browsers/{browser_id}')
 def stop_file_browser(user: Annotated[models.User, Depends(browser_owner_server_owner_or_permissions(models.Permission.ADMIN))], browser_id: str):
-    docker_runner = DockerRunner()
+    docker_runner = get_docker_runner()
     docker_runner.stop_file_browsing_by_id(browser_id=browser_id)
 
 
@@ -454,7 +479,7 @@ class SetServerNicknameRequest(BaseModel):
 
 @app.post('/servers/{server_id}/nickname', summary='Set Nickname', description='Set Nickname', openapi_extra=OpenApiExtra(api_response='Ignore', permissions=[models.Permission.ADMIN]).model_dump(mode='json'))
 def api_set_server_nickname(user: Annotated[models.User, Depends(user_with_permissions(models.Permission.ADMIN))], server_id: str, set_server_nickname_request: SetServerNicknameRequest):
-    DockerRunner().get_server_info(server_id=server_id)
+    get_docker_runner().get_server_info(server_id=server_id)
 
     with get_db() as db:
         return change_server_nickname(db, server_nickname=models.ServerNickname(server_id=server_id, nickname=set_server_nickname_request.nickname))
@@ -467,7 +492,7 @@ class SetServerPermissionsRequest(BaseModel):
 
 @app.post('/servers/{server_id}/permissions', summary='Add Permissions', openapi_extra=OpenApiExtra(api_response='Ignore', permissions=[models.Permission.ADMIN]).model_dump(mode='json'))
 def api_set_server_user_permissions(user: Annotated[models.User, Depends(user_with_permissions(models.Permission.ADMIN))], server_id: str, request: SetServerPermissionsRequest):
-    DockerRunner().get_server_info(server_id=server_id)
+    get_docker_runner().get_server_info(server_id=server_id)
     with get_db() as db:
         set_server_permissions_for_user(db, models.ServerPermissions(server_id=server_id, user_id=request.username, permissions=request.permissions))
 
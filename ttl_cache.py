@@ -0,0 +1,43 @@
+import threading
+import time
+from typing import Generic, Hashable, Optional, TypeVar
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+class TTLCache(Generic[K, V]):
+    def __init__(self, ttl: float, maxsize: Optional[int] = None):
+        self._ttl = ttl
+        self._maxsize = maxsize
+        self._items: dict[K, tuple[float, V]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: K) -> Optional[V]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                return None
+
+            return value
+
+    def set(self, key: K, value: V) -> V:
+        with self._lock:
+            if self._maxsize is not None and key not in self._items and len(self._items) >= self._maxsize:
+                del self._items[next(iter(self._items))]
+            self._items[key] = (time.monotonic() + self._ttl, value)
+        return value
+
+    def pop(self, key: K) -> Optional[V]:
+        with self._lock:
+            item = self._items.pop(key, None)
+        return item[1] if item is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()